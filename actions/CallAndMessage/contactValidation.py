@@ -3,6 +3,9 @@ from rasa_sdk import Action, Tracker, FormValidationAction
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 import logging
+import os
+
+from .contacts import ContactIndex
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +23,11 @@ phonebook = {
 }
 phonebook = {k.lower(): v for k, v in phonebook.items()}
 
+# contacts file. the phonebook above is used if it does not exist.
+CONTACTS_FILE = os.environ.get("CONTACTS_FILE", "dbtest/contacts.csv")
+contacts = ContactIndex(CONTACTS_FILE, phonebook)
+
+
 def validate_contact_name(value, dispatcher):
     log.debug("validate contact_name")
 
@@ -29,35 +37,20 @@ def validate_contact_name(value, dispatcher):
     # all comparisons are case insensitive
     value = value.lower()
 
-    # exact match in phonebook
-    if value in phonebook:
-        dispatcher.utter_message(response="utter_contact_found", contact_name=value)
-        return {"contact_name": value, "contact_number": phonebook[value]}
-
-    log.debug("validate contact_name: no match found")
-
-    # first and surname match
-    contacts = []
-    for name in value.split():
-        if len(name) < 3:
-            continue
-        found = [k for k, v in phonebook.items() if k.find(name) >= 0]
-        contacts.extend(found)
-
-        if len(contacts) == 0:
-            dispatcher.utter_message(response="utter_contact_not_found", contact_name=name)
-            return {"contact_name": None, "contact_number": None}
-
-        if len(contacts) == 1:
-            dispatcher.utter_message(
-                response="utter_contact_found", contact_name=list(contacts)[0]
-            )
-            return {"contact_name": name, "contact_number": phonebook[name]}
-
-        if len(contacts) >= 2:
-            contacts = " and ".join(contacts)
-            dispatcher.utter_message(response="utter_contacts_found", contacts=contacts)
-            return {"contact_name": None}
-
-    log.debug("validate contact_name: no partial match either")
-    return {"contact_name": None}
\ No newline at end of file
+    # exact name, first name, surname, partial or misspelled
+    found = contacts.search(value)
+    if len(found) == 0:
+        log.debug("validate contact_name: no match found")
+        dispatcher.utter_message(response="utter_contact_not_found", contact_name=value)
+        return {"contact_name": None, "contact_number": None}
+
+    # several equally good matches e.g. surname only
+    best = [c for c in found if c.score == found[0].score]
+    if len(best) >= 2:
+        contacts_found = " and ".join(c.name for c in best)
+        dispatcher.utter_message(response="utter_contacts_found", contacts=contacts_found)
+        return {"contact_name": None}
+
+    contact = found[0]
+    dispatcher.utter_message(response="utter_contact_found", contact_name=contact.name)
+    return {"contact_name": contact.name, "contact_number": contact.number}
@@ -0,0 +1,280 @@
+"""
+contact index for name lookups
+
+    contacts are loaded from CONTACTS_FILE (default dbtest/contacts.csv or .vcf)
+        csv with a header containing name and number (or phone, tel) columns
+        vcard using the FN and first TEL of each card
+    if there is no file the phonebook in contactValidation.py is used.
+    the file is checked for changes at most every CHECK_EVERY seconds. when
+    contacts are appended only the new part is read. other changes reload all.
+
+    each name token is indexed by the whole token, its prefixes and a soundex key
+    so "farida", "far" and "farrida" all find "farida watson". prefixes and soundex
+    keys lead to distinct name tokens which are ranked by how many letters differ
+    from the query token e.g. "farrida" is nearer "farida" than "frtu".
+    search returns candidates ranked by number of query tokens matched then by
+    the quality of the matches. at most MAX_CANDIDATES are scored, taken from the
+    best matching name tokens first.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Text, Tuple
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import islice
+from threading import Lock
+import csv
+import hashlib
+import io
+import os
+import re
+import time
+
+import logging
+
+log = logging.getLogger(__name__)
+
+CHECK_EVERY = 5
+# shorter query tokens are ignored unless they are a whole name token
+MIN_PREFIX = 3
+MAX_PREFIX = 6
+# scores for each query token
+EXACT, PREFIX, PHONETIC = 3, 2, 1
+# (score, -letters different) of a name token that does not match
+NO_MATCH = (0, 0)
+# candidates scored for each search
+MAX_CANDIDATES = 50
+# bytes hashed to tell an append from a rewrite
+HEAD = 4096
+
+SOUNDEX = {
+    c: str(code)
+    for code, letters in enumerate(
+        ["aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"]
+    )
+    for c in letters
+}
+
+
+def soundex(token: Text) -> Text:
+    token = re.sub(r"[^a-z]", "", token.lower())
+    if not token:
+        return ""
+    digits = []
+    last = SOUNDEX[token[0]]
+    for c in token[1:]:
+        code = SOUNDEX[c]
+        if code != "0" and code != last:
+            digits.append(code)
+        # h and w do not separate repeated codes
+        if c not in "hw":
+            last = code
+    return (token[0] + "".join(digits) + "000")[:4]
+
+
+@lru_cache(maxsize=1 << 16)
+def edit_distance(a: Text, b: Text) -> int:
+    """ levenshtein distance """
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+            )
+        previous = current
+    return previous[-1]
+
+
+def tokenize(name: Text) -> List[Text]:
+    return re.findall(r"\w+", name.lower())
+
+
+class Contact(NamedTuple):
+    name: Text
+    number: Text
+    score: int = 0
+
+
+def read_csv(text: Text, header: Optional[List[Text]] = None):
+    """ return (name, number) rows and the header """
+    reader = csv.reader(io.StringIO(text))
+    if header is None:
+        header = [x.strip().lower() for x in next(reader, [])]
+    columns = {c: i for i, c in enumerate(header)}
+    name = next((columns[c] for c in ["name", "full name", "fn"] if c in columns), 0)
+    number = next(
+        (columns[c] for c in ["number", "phone", "tel", "mobile"] if c in columns), 1
+    )
+    rows = [
+        (row[name].strip(), row[number].strip())
+        for row in reader
+        if len(row) > max(name, number) and row[name].strip()
+    ]
+    return rows, header
+
+
+def read_vcard(text: Text) -> List[Tuple[Text, Text]]:
+    rows = []
+    name = number = None
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        key = key.split(";")[0].strip().upper()
+        if key == "BEGIN":
+            name = number = None
+        elif key == "FN":
+            name = value.strip()
+        elif key == "TEL" and number is None:
+            number = value.strip()
+        elif key == "END" and name:
+            rows.append((name, number or ""))
+    return rows
+
+
+class ContactIndex:
+    def __init__(self, path: Optional[Text] = None, default: Dict[Text, Text] = None):
+        self.path = path
+        self.default = default or {}
+        self.lock = Lock()
+        self.checked = 0.0
+        # file state to detect appends
+        self.offset = 0
+        self.head = None
+        self.header = None
+        self.clear()
+        if not self.path or not os.path.exists(self.path):
+            self.add(self.default.items())
+
+    def clear(self) -> None:
+        self.contacts: List[Tuple[Text, Text]] = []
+        # name tokens of each contact
+        self.contact_tokens: List[List[Text]] = []
+        # whole name => contacts
+        self.names: Dict[Text, List[int]] = defaultdict(list)
+        # name token => contacts
+        self.tokens: Dict[Text, Set[int]] = defaultdict(set)
+        # prefix or soundex key => name tokens
+        self.prefixes: Dict[Text, Set[Text]] = defaultdict(set)
+        self.phonetic: Dict[Text, Set[Text]] = defaultdict(set)
+
+    def add(self, rows: Iterable[Tuple[Text, Text]]) -> None:
+        for name, number in rows:
+            i = len(self.contacts)
+            tokens = tokenize(name)
+            self.contacts.append((name, number))
+            self.contact_tokens.append(tokens)
+            self.names[" ".join(tokens)].append(i)
+            for token in tokens:
+                if token not in self.tokens:
+                    for n in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+                        self.prefixes[token[:n]].add(token)
+                    self.phonetic[soundex(token)].add(token)
+                self.tokens[token].add(i)
+
+    def refresh(self) -> None:
+        """ read new or changed contacts from the file """
+        now = time.time()
+        if not self.path or now - self.checked < CHECK_EVERY:
+            return
+        with self.lock:
+            self.checked = now
+            try:
+                size = os.path.getsize(self.path)
+                with open(self.path, "rb") as f:
+                    head = hashlib.sha1(f.read(HEAD)).hexdigest()
+                    if size == self.offset and head == self.head:
+                        return
+                    appended = (
+                        self.head is not None
+                        and size > self.offset
+                        and (self.offset >= HEAD and head == self.head)
+                    )
+                    if appended:
+                        f.seek(self.offset)
+                    else:
+                        f.seek(0)
+                    data = f.read()
+            except OSError:
+                return
+            # appends may be part written so only complete lines. the rest is read
+            # next time.
+            end = data.rfind(b"\n") + 1 if appended else len(data)
+            text = data[:end].decode("utf-8", errors="replace")
+            if not appended:
+                self.clear()
+                self.header = None
+            if self.path.lower().endswith((".vcf", ".vcard")):
+                rows = read_vcard(text)
+            else:
+                rows, self.header = read_csv(text, self.header)
+            self.add(rows)
+            self.offset = (self.offset if appended else 0) + end
+            self.head = head
+            log.info(
+                f"{'added' if appended else 'loaded'} {len(rows)} contacts "
+                f"from {self.path}"
+            )
+
+    def match(self, token: Text) -> Dict[Text, Tuple[int, int]]:
+        """ name token => (score, -letters different) for a query token """
+        if token in self.tokens:
+            return {token: (EXACT, 0)}
+        # partial and misspelled matches only for tokens that are not a name
+        if len(token) < MIN_PREFIX:
+            return {}
+        found = {
+            t: (PREFIX, len(token) - len(t))
+            for t in self.prefixes.get(token[:MAX_PREFIX], ())
+            if t.startswith(token)
+        }
+        for t in self.phonetic.get(soundex(token), ()):
+            if t not in found:
+                found[t] = (PHONETIC, -edit_distance(token, t))
+        return found
+
+    def search(self, value: Text, limit: int = 5) -> List[Contact]:
+        """ best matching contacts first """
+        self.refresh()
+        query = tokenize(value)
+        if not query:
+            return []
+        exact = self.names.get(" ".join(query))
+        if exact:
+            score = EXACT * len(query) + 1
+            return [Contact(*self.contacts[i], score=score) for i in exact[:limit]]
+
+        matches = [self.match(token) for token in query]
+        found = [set().union(*(self.tokens[t] for t in m)) for m in matches if m]
+        if not found:
+            return []
+        # contacts matching every token that matched anything else the most tokens
+        candidates = set.intersection(*found)
+        if not candidates:
+            counts = Counter(i for ids in found for i in ids)
+            most = max(counts.values())
+            candidates = {i for i, n in counts.items() if n == most}
+
+        # common names match thousands of contacts. take them from the best matching
+        # name tokens first and only score those.
+        ranked = sorted(
+            ((quality, t) for m in matches for t, quality in m.items()), reverse=True
+        )
+        selected: Dict[int, None] = {}
+        for _, t in ranked:
+            ids = self.tokens[t] & candidates
+            selected.update(dict.fromkeys(islice(ids, MAX_CANDIDATES - len(selected))))
+            if len(selected) >= MAX_CANDIDATES:
+                break
+
+        scored = []
+        for i in selected:
+            score = closeness = 0
+            tokens = self.contact_tokens[i]
+            for m in matches:
+                best = max([m.get(t, NO_MATCH) for t in tokens])
+                score += best[0]
+                closeness += best[1]
+            scored.append((-score, -closeness, len(self.contacts[i][0]), i))
+        scored.sort()
+        return [
+            Contact(*self.contacts[i], score=-score)
+            for score, _, _, i in scored[:limit]
+        ]
@@ -8,15 +8,8 @@ log.debug("logging started")
 log.info("logging started")
 
 import random
-import os
 
 # ensure repeatable results
 random.seed(42)
 
-# only keep conversations from current session
-root = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
-try:
-    os.remove(f"{root}/rasa.db")
-    log.warning("deleted rasa.db")
-except Exception as e:
-    log.exception("failed to delete rasa.db")
+# keep imports light. modules are loaded when first used (see registry.py)
@@ -0,0 +1,250 @@
+"""
+offline music catalog so popular artists, albums and tracks resolve without spotify
+
+    built from the tracks in the public playlists of a spotify user (default
+    "spotify" which owns the editorial playlists)
+        python -m actions.apis.catalog [owner] [max_playlists]
+    pages are fetched concurrently. playlists are only refetched when their
+    snapshot_id changes so a refresh is incremental.
+    stored in sqlite (dbtest/catalog.db) and loaded into memory on first use. reloaded
+    when the file changes.
+
+    names are matched exactly after normalizing. artists and albums not found are
+    matched fuzzy with difflib against names sharing the first PREFIX letters of a
+    word so a turn does not compare every name. track names are only exact as
+    there are many similar titles and the spotify search finds misspelt ones.
+    tracks are chosen at random from the matches.
+"""
+from typing import Dict, List, Optional, Set, Text, Tuple
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from difflib import get_close_matches
+from threading import Lock
+import os
+import random
+import sqlite3
+import sys
+
+from .scheduler import BACKGROUND
+
+import logging
+
+log = logging.getLogger(__name__)
+
+DB = "dbtest/catalog.db"
+FUZZY_CUTOFF = 0.8
+FUZZY_FIELDS = ["artist", "album"]
+# letters of each word that fuzzy candidates must share
+PREFIX = 3
+# words too common to find fuzzy candidates
+STOPWORDS = {"the", "and"}
+PLAYLIST_PAGE = 50
+TRACK_PAGE = 100
+TRACK_FIELDS = "items(track(id,name,artists(name),album(name))),total"
+
+SCHEMA = """
+create table if not exists playlist (id text primary key, name text, snapshot_id text);
+create table if not exists track (id text primary key, name text, artist text, album text);
+create table if not exists playlist_track (playlist_id text, track_id text);
+create index if not exists playlist_track_playlist on playlist_track (playlist_id);
+"""
+
+
+def normalize(value: Optional[Text]) -> Optional[Text]:
+    return " ".join(value.lower().split()) if value else None
+
+
+def prefixes(name: Text) -> Set[Text]:
+    """ first PREFIX letters of each word e.g. "ed sheeran" => {"she"} """
+    return {
+        word[:PREFIX]
+        for word in name.split()
+        if len(word) >= PREFIX and word not in STOPWORDS
+    }
+
+
+class Catalog:
+    def __init__(self, path: Text = DB):
+        self.path = path
+        self.mtime = None
+        self.lock = Lock()
+        # (name, artist, album) for each track
+        self.tracks: List[Tuple[Text, Text, Text]] = []
+        # field => normalized name => track indexes
+        self.index: Dict[Text, Dict[Text, List[int]]] = {}
+        # fuzzy field => word prefix => normalized names
+        self.prefixes: Dict[Text, Dict[Text, Set[Text]]] = {}
+
+    def load(self) -> bool:
+        """ (re)load the catalog if the file changed. false if there is no catalog. """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return True
+        with self.lock:
+            if mtime == self.mtime:
+                return True
+            db = sqlite3.connect(self.path)
+            try:
+                rows = db.execute("select name, artist, album from track").fetchall()
+            except sqlite3.Error:
+                log.exception(f"failed to load catalog {self.path}")
+                return False
+            finally:
+                db.close()
+            index = {field: defaultdict(list) for field in ["track", "artist", "album"]}
+            for i, (name, artist, album) in enumerate(rows):
+                index["track"][normalize(name)].append(i)
+                index["artist"][normalize(artist)].append(i)
+                index["album"][normalize(album)].append(i)
+            fuzzy = {field: defaultdict(set) for field in FUZZY_FIELDS}
+            for field in FUZZY_FIELDS:
+                for name in index[field]:
+                    for prefix in prefixes(name):
+                        fuzzy[field][prefix].add(name)
+            self.tracks, self.index, self.prefixes = rows, index, fuzzy
+            self.mtime = mtime
+            log.info(f"loaded catalog with {len(rows)} tracks")
+        return True
+
+    def resolve(self, field: Text, value: Text) -> Set[int]:
+        """ indexes of tracks matching the value exactly or else fuzzy """
+        names = self.index[field]
+        if value in names:
+            return set(names[value])
+        if field not in FUZZY_FIELDS:
+            return set()
+        candidates = set()
+        for prefix in prefixes(value):
+            candidates |= self.prefixes[field].get(prefix, set())
+        close = get_close_matches(value, sorted(candidates), n=3, cutoff=FUZZY_CUTOFF)
+        return {i for name in close for i in names[name]}
+
+    def find(
+        self,
+        album: Optional[Text] = None,
+        artist: Optional[Text] = None,
+        track: Optional[Text] = None,
+    ) -> Optional[Tuple[Optional[Text], Text, Text]]:
+        """ return album, artist, track or None. album is None unless requested. """
+        fields = dict(album=album, artist=artist, track=track)
+        fields = {k: normalize(v) for k, v in fields.items() if v}
+        if not fields or not self.load():
+            return None
+        matches = None
+        for field, value in fields.items():
+            found = self.resolve(field, value)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return None
+        name, artist, album_name = self.tracks[random.choice(sorted(matches))]
+        return (album_name if album else None), artist, name
+
+
+################################################################
+# build
+
+
+def fetch_pages(pool, fetch, limit, first):
+    """ return items of all pages. pages after the first are fetched concurrently. """
+    offsets = range(limit, first["total"], limit)
+    pages = pool.map(lambda offset: fetch(offset)["items"], offsets)
+    return first["items"] + [x for page in pages for x in page]
+
+
+def refresh(
+    client,
+    owner: Text = "spotify",
+    path: Text = DB,
+    max_playlists=None,
+    workers=8,
+    scheduler=None,
+):
+    """ fetch playlists with a new snapshot_id and save their tracks
+
+    with a scheduler the calls are BACKGROUND priority so they give way to lookups
+    """
+
+    def call(fn, *args, **kwargs):
+        if scheduler is None:
+            return fn(*args, **kwargs)
+        return scheduler.call(fn, *args, priority=BACKGROUND, **kwargs)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    known = dict(db.execute("select id, snapshot_id from playlist"))
+
+    with ThreadPoolExecutor(workers) as pool:
+
+        def playlists(offset):
+            return call(
+                client.user_playlists, owner, limit=PLAYLIST_PAGE, offset=offset
+            )
+
+        items = fetch_pages(pool, playlists, PLAYLIST_PAGE, playlists(0))
+        items = [x for x in items if x][:max_playlists]
+        changed = [x for x in items if known.get(x["id"]) != x["snapshot_id"]]
+        log.info(f"{len(changed)} of {len(items)} playlists changed")
+
+        def playlist_tracks(playlist):
+            def page(offset):
+                return call(
+                    client.playlist_items,
+                    playlist["id"],
+                    fields=TRACK_FIELDS,
+                    limit=TRACK_PAGE,
+                    offset=offset,
+                    additional_types=("track",),
+                )
+
+            return fetch_pages(pool, page, TRACK_PAGE, page(0))
+
+        # playlists in parallel each with its pages in parallel would deadlock a
+        # shared pool. so playlists are fetched one at a time.
+        for playlist in changed:
+            try:
+                tracks = [x["track"] for x in playlist_tracks(playlist)]
+            except Exception:
+                log.exception(f"failed to fetch playlist {playlist['name']}")
+                continue
+            tracks = [x for x in tracks if x and x.get("id") and x.get("artists")]
+            with db:
+                db.execute(
+                    "delete from playlist_track where playlist_id=?", (playlist["id"],)
+                )
+                db.executemany(
+                    "insert or replace into track values (?, ?, ?, ?)",
+                    [
+                        (x["id"], x["name"], x["artists"][0]["name"], x["album"]["name"])
+                        for x in tracks
+                    ],
+                )
+                db.executemany(
+                    "insert into playlist_track values (?, ?)",
+                    [(playlist["id"], x["id"]) for x in tracks],
+                )
+                db.execute(
+                    "insert or replace into playlist values (?, ?, ?)",
+                    (playlist["id"], playlist["name"], playlist["snapshot_id"]),
+                )
+            log.info(f"{playlist['name']}: {len(tracks)} tracks")
+
+    with db:
+        # tracks no longer in any playlist
+        db.execute(
+            "delete from track where id not in (select track_id from playlist_track)"
+        )
+    count = db.execute("select count(*) from track").fetchone()[0]
+    db.close()
+    log.info(f"catalog has {count} tracks")
+
+
+if __name__ == "__main__":
+    from .spotify import get_client, scheduler
+
+    owner = sys.argv[1] if len(sys.argv) > 1 else "spotify"
+    max_playlists = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    refresh(get_client(), owner, max_playlists=max_playlists, scheduler=scheduler)
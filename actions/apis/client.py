@@ -0,0 +1,87 @@
+"""
+shared async http client for the external apis
+
+    one pooled aiohttp session per event loop so connections (and tls) are reused
+    across turns. the action server runs a single loop.
+    connections per host are limited. every request has a timeout.
+    connection errors, timeouts, 429 and 5xx are retried with exponential backoff
+    and full jitter. APIError is raised when the retries are used up.
+"""
+from typing import Any, Dict, Optional, Text
+import asyncio
+import random
+
+import aiohttp
+
+import logging
+
+log = logging.getLogger(__name__)
+
+LIMIT_PER_HOST = 8
+TIMEOUT = aiohttp.ClientTimeout(total=5, connect=2)
+RETRIES = 2
+BACKOFF = 0.2
+# longer Retry-After is not worth waiting for within a turn
+MAX_RETRY_AFTER = 2
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_session: Optional[aiohttp.ClientSession] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class APIError(Exception):
+    def __init__(self, url: Text, status: Optional[int] = None, reason: Text = ""):
+        self.url = url
+        self.status = status
+        super().__init__(f"{url} failed status={status} {reason}".strip())
+
+
+def get_session() -> aiohttp.ClientSession:
+    """ return the session for the running loop. created on first use. """
+    global _session, _loop
+    loop = asyncio.get_event_loop()
+    if _session is None or _session.closed or _loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=LIMIT_PER_HOST, ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=TIMEOUT)
+        _loop = loop
+    return _session
+
+
+async def close() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def backoff(attempt: int, retry_after: Optional[Text] = None) -> float:
+    """ seconds to wait before the next attempt """
+    try:
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return random.uniform(0, BACKOFF * 2 ** attempt)
+
+
+async def get_json(
+    url: Text, params: Optional[Dict[Text, Any]] = None, retries: int = RETRIES
+) -> Any:
+    """ GET url and return the json body """
+    for attempt in range(retries + 1):
+        retry_after = None
+        try:
+            async with get_session().get(url, params=params) as response:
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                if response.status not in RETRY_STATUS:
+                    raise APIError(url, response.status, response.reason)
+                retry_after = response.headers.get("Retry-After")
+                error = APIError(url, response.status, response.reason)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = APIError(url, reason=repr(e))
+        if attempt < retries:
+            wait = backoff(attempt, retry_after)
+            log.warning(f"{error}. retry in {wait:.2f}s")
+            await asyncio.sleep(wait)
+    raise error
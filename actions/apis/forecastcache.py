@@ -0,0 +1,108 @@
+"""
+forecast cache shared by Weather and WeatherTemperature
+
+    key is lat, lon rounded to 2 decimals (about 1km) and unit
+    openweathermap updates about every 10 minutes which is the ttl
+    concurrent requests for the same key share one upstream call
+    after the ttl the old forecast is kept for a grace period. it is returned if
+    the refresh fails or takes longer than stale_timeout. a slow refresh carries
+    on in the background and updates the cache.
+"""
+from typing import Any, Awaitable, Callable, Dict, Text
+from collections import OrderedDict
+import asyncio
+import time
+
+from .client import APIError
+
+import logging
+
+log = logging.getLogger(__name__)
+
+TTL = 10 * 60
+GRACE = 60 * 60
+STALE_TIMEOUT = 1.5
+
+
+def _retrieve(task: asyncio.Future) -> None:
+    """ avoid "exception was never retrieved" when no one waited for the result """
+    if not task.cancelled():
+        task.exception()
+
+
+class ForecastCache:
+    def __init__(
+        self,
+        ttl: float = TTL,
+        grace: float = GRACE,
+        stale_timeout: float = STALE_TIMEOUT,
+        maxsize: int = 256,
+        precision: int = 2,
+    ):
+        self.ttl = ttl
+        self.grace = grace
+        self.stale_timeout = stale_timeout
+        self.maxsize = maxsize
+        self.precision = precision
+        # key => (forecast, fetched time)
+        self.items = OrderedDict()
+        self.pending: Dict[Any, asyncio.Future] = {}
+        self.counts = dict(hits=0, stale_hits=0, coalesced=0, fetches=0, errors=0)
+
+    async def get(
+        self,
+        lat: float,
+        lon: float,
+        unit: Text,
+        fetch: Callable[[float, float, Text], Awaitable[Dict[Text, Any]]],
+    ) -> Dict[Text, Any]:
+        """ return forecast for rounded lat, lon. fetch(lat, lon, unit) if needed. """
+        key = (round(lat, self.precision), round(lon, self.precision), unit)
+        now = time.time()
+        item = self.items.get(key)
+        if item is not None and now - item[1] < self.ttl:
+            self.items.move_to_end(key)
+            self.counts["hits"] += 1
+            return item[0]
+
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(key, fetch))
+            task.add_done_callback(_retrieve)
+            self.pending[key] = task
+        else:
+            self.counts["coalesced"] += 1
+
+        if item is None or now - item[1] >= self.ttl + self.grace:
+            # shield so a cancelled caller does not cancel the shared request
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.stale_timeout)
+        except (asyncio.TimeoutError, APIError) as e:
+            self.counts["stale_hits"] += 1
+            log.warning(f"using forecast from {now - item[1]:.0f}s ago. {e!r}")
+            return item[0]
+
+    async def _refresh(self, key, fetch):
+        self.counts["fetches"] += 1
+        try:
+            forecast = await fetch(*key)
+        except Exception:
+            self.counts["errors"] += 1
+            raise
+        finally:
+            self.pending.pop(key, None)
+        self.items[key] = (forecast, time.time())
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return forecast
+
+    def stats(self) -> Dict[Text, Any]:
+        requests = self.counts["hits"] + self.counts["fetches"] + self.counts["coalesced"]
+        served = requests - self.counts["fetches"]
+        return dict(
+            **self.counts,
+            size=len(self.items),
+            hit_rate=round(served / requests, 3) if requests else None,
+        )
@@ -0,0 +1,140 @@
+"""
+geocode cache so each location is looked up once
+
+    key is the normalized location e.g. " London, " => "london"
+    in-memory lru in front of sqlite (dbtest/geocode.db) which survives restarts
+    of the action container as dbtest is mounted.
+    places do not move so the ttl is long. locations that are not found are also
+    cached with a shorter ttl so typos do not use up the api quota.
+"""
+from typing import Any, Dict, Optional, Text, Tuple
+from collections import OrderedDict
+from threading import Lock
+import os
+import re
+import sqlite3
+import time
+
+import logging
+
+log = logging.getLogger(__name__)
+
+DB = "dbtest/geocode.db"
+TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+
+# returned by get when not cached. None is a cached "not found".
+MISS = object()
+
+
+def normalize(location: Text) -> Text:
+    return " ".join(re.sub(r"[^\w\s]", " ", str(location).lower()).split())
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        path: Text = DB,
+        maxsize: int = 1024,
+        ttl: float = TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = OrderedDict()
+        # negative_hits are included in hits and disk_hits
+        self.counts = dict(hits=0, disk_hits=0, negative_hits=0, misses=0)
+        self.lock = Lock()
+        self._db = None
+
+    @property
+    def db(self) -> Optional[sqlite3.Connection]:
+        """ opened on first use. None if not available. """
+        if self._db is None and self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute(
+                    "create table if not exists geocode "
+                    "(key text primary key, lat real, lon real, expires real)"
+                )
+                db.commit()
+                self._db = db
+            except sqlite3.Error:
+                log.exception(f"geocode cache is memory only. cannot open {self.path}")
+                self.path = None
+        return self._db
+
+    def get(self, location: Text) -> Any:
+        """ return (lat, lon), None if not found or MISS """
+        key = normalize(location)
+        now = time.time()
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None and item[1] > now:
+                self.memory.move_to_end(key)
+                self.counts["hits"] += 1
+                return self._found(item[0])
+            item = self._load(key, now)
+            if item is None:
+                self.counts["misses"] += 1
+                return MISS
+            self._remember(key, *item)
+            self.counts["disk_hits"] += 1
+            return self._found(item[0])
+
+    def set(self, location: Text, position: Optional[Tuple[float, float]]) -> None:
+        key = normalize(location)
+        expires = time.time() + (self.ttl if position else self.negative_ttl)
+        with self.lock:
+            self._remember(key, position, expires)
+            if self.db is None:
+                return
+            lat, lon = position or (None, None)
+            try:
+                self.db.execute(
+                    "insert or replace into geocode values (?, ?, ?, ?)",
+                    (key, lat, lon, expires),
+                )
+                self.db.commit()
+            except sqlite3.Error:
+                log.exception("failed to save geocode")
+
+    def stats(self) -> Dict[Text, Any]:
+        hits = self.counts["hits"] + self.counts["disk_hits"]
+        lookups = hits + self.counts["misses"]
+        return dict(
+            **self.counts,
+            size=len(self.memory),
+            hit_rate=round(hits / lookups, 3) if lookups else None,
+        )
+
+    def _found(self, position):
+        if position is None:
+            self.counts["negative_hits"] += 1
+        return position
+
+    def _remember(self, key, position, expires):
+        self.memory[key] = (position, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def _load(self, key, now):
+        """ return (position, expires) from disk or None """
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(
+                "select lat, lon, expires from geocode where key=? and expires>?",
+                (key, now),
+            ).fetchone()
+        except sqlite3.Error:
+            log.exception("failed to read geocode")
+            return None
+        if row is None:
+            return None
+        lat, lon, expires = row
+        return (None if lat is None else (lat, lon)), expires
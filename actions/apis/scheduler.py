@@ -0,0 +1,141 @@
+"""
+rate control for calls to an external api from many threads
+
+    token bucket of rate requests per second with bursts up to burst
+    waiting calls go in priority order e.g. INTERACTIVE lookups before BACKGROUND
+    catalog refresh. calls with the same priority go in order of arrival.
+    when a call is throttled (e.g. 429) the Retry-After applies to every call. the
+    throttled call is queued again.
+    calls that cannot start before their deadline are dropped with DeadlineExceeded
+
+    stats() has calls, queue depth, wait times, throttled and dropped counts. also
+    logged every log_every calls.
+"""
+from typing import Any, Callable, Dict, Optional, Text
+from collections import deque
+from itertools import count
+from threading import Condition
+from time import monotonic
+import heapq
+
+import logging
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Scheduler:
+    def __init__(
+        self,
+        name: Text,
+        rate: float = 10,
+        burst: int = 20,
+        retry_after: Callable[[Exception], Optional[float]] = lambda e: None,
+        retries: int = 2,
+        log_every: int = 100,
+    ):
+        """
+        retry_after returns seconds to wait if the exception means throttled else None
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.retries = retries
+        self.log_every = log_every
+
+        self.cond = Condition()
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+        self.queue = []
+        self.seq = count()
+
+        self.counts = dict(calls=0, throttled=0, dropped=0, errors=0, max_depth=0)
+        self.waits = deque(maxlen=1000)
+
+    def call(
+        self,
+        fn: Callable,
+        *args,
+        priority: int = INTERACTIVE,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ) -> Any:
+        """ fn(*args, **kwargs) when allowed. deadline is a time.monotonic() value. """
+        for attempt in range(self.retries + 1):
+            self.acquire(priority, deadline)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                wait = self.retry_after(e)
+                if wait is None or attempt == self.retries:
+                    with self.cond:
+                        self.counts["errors"] += 1
+                    raise
+                self.throttle(wait)
+
+    def acquire(self, priority: int, deadline: Optional[float]) -> None:
+        """ wait for a token and our turn """
+        enqueued = monotonic()
+        entry = (priority, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.queue, entry)
+            self.counts["max_depth"] = max(self.counts["max_depth"], len(self.queue))
+            try:
+                while True:
+                    now = monotonic()
+                    if deadline is not None and (
+                        now >= deadline or self.blocked_until >= deadline
+                    ):
+                        self.counts["dropped"] += 1
+                        raise DeadlineExceeded(f"{self.name} deadline passed in queue")
+                    wait = None
+                    if self.queue[0] == entry:
+                        self._fill(now)
+                        if now < self.blocked_until:
+                            wait = self.blocked_until - now
+                        elif self.tokens >= 1:
+                            self.tokens -= 1
+                            break
+                        else:
+                            wait = (1 - self.tokens) / self.rate
+                    if deadline is not None:
+                        remaining = deadline - now
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self.cond.wait(wait)
+            finally:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+            self.counts["calls"] += 1
+            self.waits.append((monotonic() - enqueued) * 1000)
+            if self.counts["calls"] % self.log_every == 0:
+                log.info(f"{self.name} scheduler {self.stats()}")
+
+    def throttle(self, seconds: float) -> None:
+        """ block all calls for seconds """
+        with self.cond:
+            self.counts["throttled"] += 1
+            self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+            self.cond.notify_all()
+        log.warning(f"{self.name} throttled for {seconds}s")
+
+    def _fill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def stats(self) -> Dict[Text, Any]:
+        waits = sorted(self.waits)
+        return dict(
+            **self.counts,
+            depth=len(self.queue),
+            wait_mean_ms=round(sum(waits) / len(waits), 1) if waits else None,
+            wait_p95_ms=round(waits[int(len(waits) * 0.95)], 1) if waits else None,
+        )
@@ -8,37 +8,161 @@ setup:
         client_id, client_secret, redirect_url as keys in creds.yml
         ~/.spotify/creds.yml (local usage)
         /etc/rasa/credentials/.spotify/creds.yml (rasax server usage)
+        SPOTIFY_CREDS=path overrides /etc/rasa/credentials
+        without credentials music search is unavailable but actions still run
+
+    tracks are found in the offline catalog (see catalog.py) if possible
+    api calls go through a rate limiting scheduler (see scheduler.py)
+
+    SPOTIFY_API_PREFIX and SPOTIFY_TOKEN_URL point the client at another server e.g. for
+    scripts/benchmark_actions.py
 """
 
 import spotipy
 import os
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
 import yaml
 import random
 from ..defaultlog import log
+from .catalog import Catalog
+from .scheduler import Scheduler
+
 
-try:
-    # auth in rasa actions docker container
-    with open("/app/credentials/.spotify/creds.yml") as f:
-        creds = yaml.safe_load(f)
-except FileNotFoundError:
-    # auth locally using home folder
-    log.warning("using creds from home folder")
+def load_credentials():
+    """ return client_id, client_secret or None if there are no credentials """
     HOME = os.path.expanduser("~")
-    with open(f"{HOME}/.spotify/creds.yml") as f:
-        creds = yaml.safe_load(f)
+    paths = [
+        # auth in rasa actions docker container
+        os.environ.get("SPOTIFY_CREDS", "/app/credentials/.spotify/creds.yml"),
+        # auth locally using home folder
+        f"{HOME}/.spotify/creds.yml",
+    ]
+    for path in paths:
+        try:
+            with open(path) as f:
+                creds = yaml.safe_load(f)
+        except FileNotFoundError:
+            continue
+        log.info(f"using spotify creds from {path}")
+        return dict(client_id=creds["client_id"], client_secret=creds["client_secret"])
+    return None
+
+
+class SpotifyClientManager:
+    """ process wide spotify client created on first use
+
+    uses client credentials which do not allow user details but have a faster rate
+    limit than SpotifyOAuth. tokens are kept in memory and refreshed by a background
+    thread before they expire so requests do not wait for the oauth round trip.
+    http connections are pooled and shared by the token and api requests.
+    without credentials get() returns None and music search is unavailable. the
+    credentials are checked again after retry seconds.
+    """
+
+    def __init__(self, refresh_margin=300, retry=60, pool_size=8):
+        self.refresh_margin = refresh_margin
+        self.retry = retry
+        self.pool_size = pool_size
+        self.client = None
+        self.auth = None
+        self.unavailable_until = 0
+        self.lock = Lock()
+        self.stop = Event()
+
+    def get(self):
+        if self.client is not None:
+            return self.client
+        if time.time() < self.unavailable_until:
+            return None
+        with self.lock:
+            if self.client is None and time.time() >= self.unavailable_until:
+                self._create()
+        return self.client
+
+    def _create(self):
+        creds = load_credentials()
+        if creds is None:
+            log.warning("no spotify credentials. music search is unavailable")
+            self.unavailable_until = time.time() + self.retry
+            return
+
+        session = requests.Session()
+        # no retries in urllib3 so a 429 reaches spotipy as a response with headers
+        # rather than a retry error without them
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(total=0, read=False, raise_on_status=False),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        auth = SpotifyClientCredentials(
+            **creds, cache_handler=MemoryCacheHandler(), requests_session=session
+        )
+        auth.OAUTH_TOKEN_URL = os.environ.get("SPOTIFY_TOKEN_URL", auth.OAUTH_TOKEN_URL)
+        # retries are done by the scheduler so one request cannot hold up the rest
+        client = spotipy.Spotify(
+            auth_manager=auth, requests_session=session, retries=0
+        )
+        client.prefix = os.environ.get("SPOTIFY_API_PREFIX", client.prefix)
+        self.auth = auth
+        self.client = client
+        Thread(target=self._refresh, daemon=True, name="spotify-token").start()
+
+    def _refresh(self):
+        """ get a new token before the current one expires """
+        while not self.stop.is_set():
+            try:
+                self.auth.get_access_token(as_dict=False, check_cache=False)
+                token = self.auth.cache_handler.get_cached_token()
+                wait = token["expires_at"] - time.time() - self.refresh_margin
+                log.debug(f"spotify token refreshed. next refresh in {wait:.0f}s")
+            except Exception:
+                log.exception("failed to refresh spotify token")
+                wait = self.retry
+            self.stop.wait(max(wait, self.retry))
+
+    def close(self):
+        self.stop.set()
+
+
+manager = SpotifyClientManager()
+
+
+def retry_after(e):
+    """ seconds to wait if spotify said too many requests """
+    if isinstance(e, SpotifyException) and e.http_status == 429:
+        headers = getattr(e, "headers", None)
+        if not headers:
+            # the requests error that spotipy wrapped
+            response = getattr(e.__context__, "response", None)
+            headers = getattr(response, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After", 1))
+        except ValueError:
+            return 1.0
+    return None
+
 
-# allows user details. slower rate limit. does not apepar to work on wsl2?
-# sp = spotipy.Spotify(auth_manager=SpotifyOAuth(**creds, scope="user-library-read"))
+scheduler = Scheduler("spotify", retry_after=retry_after)
 
-# does not allow user details. does not have redirect_url
-del creds["redirect_uri"]
-auth_manager = SpotifyClientCredentials(**creds)
-sp = spotipy.Spotify(auth_manager=auth_manager)
+
+def get_client():
+    """ shared spotify client or None if there are no credentials """
+    return manager.get()
 
 
 def search(q, type_):
-    results = sp.search(q=q, type=type_)
+    results = get_client().search(q=q, type=type_)
     items = results["artists"]["items"]
     if len(items) > 0:
         artist = items[0]
@@ -48,7 +172,7 @@ def search(q, type_):
 
 def get_top(id):
     lz_uri = f"spotify:artist:{id}"
-    results = sp.artist_top_tracks(lz_uri)
+    results = get_client().artist_top_tracks(lz_uri)
     for track in results["tracks"][:10]:
         print("track    : " + track["name"])
         print("audio    : " + track["preview_url"])
@@ -57,7 +181,7 @@ def get_top(id):
 
 
 def get_playlists():
-    playlists = sp.user_playlists("spotify")
+    playlists = get_client().user_playlists("spotify")
     while playlists:
         for i, playlist in enumerate(playlists["items"]):
             print(
@@ -65,60 +189,147 @@ def get_playlists():
                 % (i + 1 + playlists["offset"], playlist["uri"], playlist["name"])
             )
         if playlists["next"]:
-            playlists = sp.next(playlists)
+            playlists = get_client().next(playlists)
         else:
             playlists = None
 
 
 def get_user_saved():
-    results = sp.current_user_saved_tracks()
+    results = get_client().current_user_saved_tracks()
     for idx, item in enumerate(results["items"]):
         track = item["track"]
         print(idx, track["artists"][0]["name"], " – ", track["name"])
 
 
-def get_track(album=None, artist=None, track=None):
-    if album:
-        album = album.lower()
-    if artist:
-        artist = artist.lower()
-    if track:
-        track = track.lower()
+def normalize(value):
+    return " ".join(value.lower().split()) if value else None
 
-    items = []
-    if track:
-        results = sp.search(q=f"track:{track}", type="track")
-        items = results["tracks"]["items"]
-        if album:
-            items = [x for x in items if x["album"]["name"].lower().find(album) >= 0]
-        if artist:
-            items = [x for x in items if x["artists"][0]["name"].lower() == artist]
-    elif album:
-        results = sp.search(q=f"album:{album}", type="track")
-        items = results["tracks"]["items"]
-        if artist:
-            artists = [x["artists"][0]["name"].lower() for x in items]
-            items = [x for x in items if x["artists"][0]["name"].lower() == artist]
-    elif artist:
-        results = sp.search(q=f"artist:{artist}", type="track")
-        items = results["tracks"]["items"]
+
+def match(item, album, artist):
+    """ album is part of the album name. artist is part of the first artist. """
+    if album and item["album"]["name"].lower().find(album) < 0:
+        return False
+    if artist and item["artists"][0]["name"].lower().find(artist) < 0:
+        return False
+    return True
+
+
+class TrackLookup:
+    """ find tracks using one query with all the fields
+
+    e.g. track:eraser artist:ed sheeran
+    results are checked against the album and artist. pages are fetched until there
+    is a match, up to max_pages. if nothing matches there is no track. a query with
+    one field e.g. artist:bowie uses spotify's results as they are.
+    results are cached per normalized (album, artist, track) for ttl seconds.
+    """
+
+    def __init__(self, ttl=3600, maxsize=1024, page_size=20, max_pages=3):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.counts = dict(hits=0, misses=0, pages=0, search_ms=0.0, last_ms=0.0)
+
+    def query(self, album, artist, track):
+        fields = dict(track=track, artist=artist, album=album)
+        return " ".join(f"{k}:{v}" for k, v in fields.items() if v)
+
+    def search(self, album, artist, track, deadline=None):
+        """ return tracks matching the album and artist. empty if none do. """
+        client = get_client()
+        q = self.query(album, artist, track)
+        items = []
+        results = scheduler.call(
+            client.search, q=q, type="track", limit=self.page_size, deadline=deadline
+        )
+        if len([x for x in (album, artist, track) if x]) == 1:
+            self.counts["pages"] += 1
+            return results["tracks"]["items"]
+        for page in range(self.max_pages):
+            self.counts["pages"] += 1
+            tracks = results["tracks"]
+            items.extend(tracks["items"])
+            matched = [x for x in items if match(x, album, artist)]
+            if matched:
+                return matched
+            if page + 1 == self.max_pages or not tracks["next"]:
+                break
+            results = scheduler.call(client.next, tracks, deadline=deadline)
+        return []
+
+    def candidates(self, album, artist, track, deadline=None):
+        key = (album, artist, track)
+        now = time.time()
+        if get_client() is None:
+            return []
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and cached[1] > now:
+                self.cache.move_to_end(key)
+                self.counts["hits"] += 1
+                return cached[0]
+        start = time.perf_counter()
+        items = self.search(album, artist, track, deadline)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.counts["misses"] += 1
+            self.counts["search_ms"] += elapsed
+            self.counts["last_ms"] = elapsed
+            self.cache[key] = (items, now + self.ttl)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        log.debug(f"spotify search {key} {elapsed:.0f}ms {len(items)} tracks")
+        return items
+
+    def find(self, album=None, artist=None, track=None, deadline=None):
+        """ return album, artist, track or None. album is None unless requested.
+
+        deadline is a time.monotonic() value. DeadlineExceeded if spotify calls
+        cannot start by then.
+        """
+        album, artist, track = normalize(album), normalize(artist), normalize(track)
+        if not (album or artist or track):
+            return None
+        items = self.candidates(album, artist, track, deadline)
+        if not items:
+            return None
+        item = random.choice(items)
         if album:
-            items = [x for x in items if x["album"][0]["name"].lower().find(album) >= 0]
+            album = item["album"]["name"]
+        return album, item["artists"][0]["name"], item["name"]
+
+    def stats(self):
+        searches = self.counts["misses"]
+        lookups = searches + self.counts["hits"]
+        return dict(
+            **self.counts,
+            size=len(self.cache),
+            hit_rate=round(self.counts["hits"] / lookups, 3) if lookups else None,
+            mean_search_ms=round(self.counts["search_ms"] / searches, 1)
+            if searches
+            else None,
+        )
+
+
+tracks = TrackLookup()
+
+
+catalog = Catalog()
 
-    if len(items) == 0:
-        return None
-    track = random.choice(items)
-    artist = track["artists"][0]["name"]
-    if album:
-        album = track["album"]["name"]
-    track = track["name"]
 
-    return album, artist, track
+def get_track(album=None, artist=None, track=None, deadline=None):
+    """ offline catalog first then the spotify api """
+    return catalog.find(album, artist, track) or tracks.find(
+        album, artist, track, deadline
+    )
 
 
 if __name__ == "__main__":
 
-    # print(sp.current_user())
+    # print(get_client().current_user())
     # name, image, id = search("artist:bowie", "artist")
     # get_top(id)
     # print(name, image, id)
@@ -153,7 +364,7 @@ if __name__ == "__main__":
     # todo multiple inputs. how should they be combined?
     # artist = "the Beatles"
     # album = "Abbey Road"
-    # results = sp.search(q=f"artist:{artist} album:{album}", type="track")
+    # results = get_client().search(q=f"artist:{artist} album:{album}", type="track")
     # print(results["tracks"]["items"][0].keys())
     # # track = random.choice(results["tracks"])["name"]
     # print(track)
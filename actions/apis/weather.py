@@ -0,0 +1,72 @@
+"""
+weather apis
+
+    OPEN WEATHER MAP --> https://openweathermap.org/api/one-call-api
+        create your own account, get your api key
+        subscribe: Current Weather Data and One Call API
+    POSITION STACK --> https://positionstack.com/documentation
+        get the Geo-coordinates from city or place name
+
+    api keys are read from the environment when used
+        OPEN_WEATHER_MAP_API_KEY, POSITION_STACK_API_KEY
+
+    geocode results are cached. see geocache.py
+    forecasts are cached and shared by concurrent requests. see forecastcache.py
+"""
+from typing import Any, Dict, Optional, Text, Tuple
+import os
+
+import logging
+
+from .client import get_json
+from .geocache import GeocodeCache, MISS
+from .forecastcache import ForecastCache
+
+log = logging.getLogger(__name__)
+
+OPEN_WEATHER_MAP_API_ENDPOINT = os.environ.get(
+    "OPEN_WEATHER_MAP_API_ENDPOINT", "https://api.openweathermap.org/data/2.5/onecall"
+)
+POSITION_STACK_API_ENDPOINT = os.environ.get(
+    "POSITION_STACK_API_ENDPOINT", "http://api.positionstack.com/v1/forward"
+)
+
+geocache = GeocodeCache()
+forecasts = ForecastCache()
+
+
+async def geocode(location: Text) -> Optional[Tuple[float, float]]:
+    """ return lat, lon of location or None if not found """
+    position = geocache.get(location)
+    if position is not MISS:
+        return position
+    params = {
+        "access_key": os.environ["POSITION_STACK_API_KEY"],
+        "query": str(location),
+    }
+    data = await get_json(POSITION_STACK_API_ENDPOINT, params)
+    places = data.get("data") or []
+    position = (places[0]["latitude"], places[0]["longitude"]) if places else None
+    geocache.set(location, position)
+    log.debug(f"geocode cache {geocache.stats()}")
+    return position
+
+
+async def forecast(lat: float, lon: float, unit: Text) -> Dict[Text, Any]:
+    """ return one call response with current and daily forecast """
+    return await forecasts.get(lat, lon, unit, fetch_forecast)
+
+
+async def fetch_forecast(lat: float, lon: float, unit: Text) -> Dict[Text, Any]:
+    params = {
+        "lat": str(lat),
+        "lon": str(lon),
+        "exclude": "minutely,hourly",
+        "appid": os.environ["OPEN_WEATHER_MAP_API_KEY"],
+    }
+    # default is kelvin
+    if unit:
+        params["units"] = unit
+    data = await get_json(OPEN_WEATHER_MAP_API_ENDPOINT, params)
+    log.debug(f"forecast cache {forecasts.stats()}")
+    return data
@@ -4,14 +4,21 @@ from rasa_sdk import Action, FormValidationAction, Tracker
 from rasa_sdk.events import AllSlotsReset, Restarted, SlotSet, EventType
 from rasa_sdk.executor import CollectingDispatcher
 from .apis.spotify import get_track
+from .apis.scheduler import DeadlineExceeded
 from rasa_sdk import Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.types import DomainDict
 
+import asyncio
 import logging
+from time import monotonic
 
 log = logging.getLogger(__name__)
 
+# seconds allowed for the spotify lookup. a slow lookup carries on in the background
+# and its result is cached for the next request.
+DEADLINE = 2.5
+
 class ValidateMusicPlayForm(FormValidationAction):
     def name(self):
         return "validate_music_play_form"
@@ -39,7 +46,7 @@ class SubmitMusicPlayForm(Action):
     def name(self):
         return "submit_music_play_form"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -64,7 +71,20 @@ class SubmitMusicPlayForm(Action):
             dispatcher.utter_message(text=f"playing playlist {playlist}")
             return reset
 
-        res = get_track(album, artist, song)
+        loop = asyncio.get_event_loop()
+        deadline = monotonic() + DEADLINE
+        try:
+            res = await asyncio.wait_for(
+                loop.run_in_executor(None, get_track, album, artist, song, deadline),
+                DEADLINE,
+            )
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            log.warning(f"spotify lookup took longer than {DEADLINE}s")
+            dispatcher.utter_message("sorry, spotify is not responding. please try again")
+            return reset
+        except Exception:
+            log.exception("spotify lookup failed")
+            res = None
         if res is None:
             dispatcher.utter_message("unable to locate song")
             return reset
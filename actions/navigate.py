@@ -1,13 +1,19 @@
 import os
 import json
+import time
 from typing import Any, Dict, List, Text
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
+from functools import lru_cache
 
 from rasa_sdk import Action, FormValidationAction, Tracker
 from rasa_sdk.events import AllSlotsReset, Restarted, SlotSet
 from rasa_sdk.executor import CollectingDispatcher
 
+from .speed import SNAPSHOT, ZONES, SpeedAccumulator, SpeedReport, analyse
+from .triplog import TRIP_LOG, TripLog
+from .triphistory import HISTORY, TripHistory
+
 import logging
 
 log = logging.getLogger(__name__)
@@ -39,53 +45,84 @@ speed_limits = (
 actual_speed = [50] * 20 + [85] * 10 + [110] * 30 + [40] * 25
 
 # DB is only used for testing. in production would likely use the postgres container.
-os.makedirs("dbtest", exist_ok=True)
 DB = "dbtest/navigate.json"
-if not os.path.exists(DB):
-    with open(DB, "w") as f:
-        json.dump(database, f)
+
+
+def get_db():
+    """ path to the database. created with the mock data on first use. """
+    if not os.path.exists(DB):
+        os.makedirs(os.path.dirname(DB), exist_ok=True)
+        with open(DB, "w") as f:
+            json.dump(database, f)
+    return DB
+
+
+@lru_cache(maxsize=None)
+def get_history() -> TripHistory:
+    """ trip history and saved places. the json database is migrated on first use. """
+    history = TripHistory(HISTORY)
+    history.migrate(get_db())
+    return history
+
+
+def get_frequent_destination(
+    sender_id=None,
+    now=None,
+    weeks_limit=5,
+    weekly_events_min_count=3,
+    daily_events_min_count=10,
+):
+    """ where the user usually goes at this time. see TripHistory.frequent_destination """
+    return get_history().frequent_destination(
+        sender_id, now, weeks_limit, weekly_events_min_count, daily_events_min_count
+    )
 
 date_string_pattern = "%H.%M %d.%m.%y"
 
-speed_zones = {"danger": 30, "town": 60}
+speed_zones = ZONES
 
 
 def analyse_speed(speed_limits, actual_speed, speed_zones=speed_zones):
-    speed_difference = []
-    speed_difference_by_zones = defaultdict(list)
-    for l, a in zip(speed_limits, actual_speed):
-        speed_difference.append(a - l)
-        if l <= speed_zones["danger"]:
-            # schools, road works, etc.
-            speed_difference_by_zones["danger"].append(a - l)
-        elif l <= speed_zones["town"]:
-            speed_difference_by_zones["town"].append(a - l)
-        else:
-            speed_difference_by_zones["highway"].append(a - l)
-    average_diff = round(sum(speed_difference) / len(speed_difference))
-    percent_correct_speed = round(
-        len([1 for diff in speed_difference if diff <= 0])
-        * 100
-        / len(speed_difference),
-        2,
-    )
+    """ (average_diff, percent_correct_speed, average_diff_by_zones,
+    percent_correct_speed_by_zones). use speed_report for percentiles and max.
+    """
+    report = speed_report(speed_limits, actual_speed, speed_zones)
     average_diff_by_zones = defaultdict(int)
     percent_correct_speed_by_zones = defaultdict(float)
-    for zone, speed_diffs in speed_difference_by_zones.items():
-        if len(speed_diffs) > 0:
-            average_diff_by_zones[zone] = round(sum(speed_diffs) / len(speed_diffs))
-            percent_correct_speed_by_zones[zone] = round(
-                len([1 for diff in speed_diffs if diff <= 0]) * 100 / len(speed_diffs),
-                2,
-            )
+    for zone, stats in report.zones.items():
+        average_diff_by_zones[zone] = round(stats.total_diff / stats.samples)
+        percent_correct_speed_by_zones[zone] = stats.percent_correct
+    overall = report.overall
     return (
-        average_diff,
-        percent_correct_speed,
+        round(overall.total_diff / overall.samples),
+        overall.percent_correct,
         average_diff_by_zones,
         percent_correct_speed_by_zones,
     )
 
 
+def speed_report(speed_limits, actual_speed, speed_zones=speed_zones) -> SpeedReport:
+    """ overall and per zone compliance. see speed.py """
+    return analyse(speed_limits, actual_speed, speed_zones)
+
+
+@lru_cache(maxsize=None)
+def get_driving() -> SpeedAccumulator:
+    """ running speed totals from the snapshot else the trip log else the mock lists """
+    driving = SpeedAccumulator.load(SNAPSHOT, speed_zones)
+    if driving.last is None and os.path.exists(TRIP_LOG):
+        # today from the trip log
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        for timestamps, limits, speeds in TripLog(TRIP_LOG).read(midnight.timestamp()):
+            driving.record_chunk(timestamps, limits, speeds)
+    if driving.last is None:
+        # mock samples every minute up to now
+        now = time.time()
+        timestamps = [now - 60 * i for i in reversed(range(len(actual_speed)))]
+        driving.record_chunk(timestamps, speed_limits, actual_speed)
+    return driving
+
+
 class ActionCheckDistance(Action):
     def name(self) -> Text:
         return "action_check_distance_to_destination"
@@ -145,12 +182,11 @@ class ActionAnalyseSpeed(Action):
         tracker: Tracker,
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
-        (
-            average_diff,
-            percent_correct_speed,
-            average_diff_by_zones,
-            percent_correct_speed_by_zones,
-        ) = analyse_speed(speed_limits, actual_speed)
+        report = get_driving().report("today")
+        percent_correct_speed = report.overall.percent_correct
+        if percent_correct_speed is None:
+            dispatcher.utter_message(text="There is no driving to analyse yet.")
+            return []
         if percent_correct_speed < 50:
             dispatcher.utter_message(
                 text="You exceeded speed limits by more than half of the driving time. Could you drive more carefully next time?"
@@ -164,10 +200,16 @@ class ActionAnalyseSpeed(Action):
                 text="Congratulations! You are great at observing speed limits. Thanks for keeping yourself and others safe!"
             )
 
-        for zone, percent in percent_correct_speed_by_zones.items():
+        for zone, stats in report.zones.items():
             dispatcher.utter_message(
                 text="In {0} zone, you drove correctly {1} percent of time today.".format(
-                    zone, percent
+                    zone, stats.percent_correct
+                )
+            )
+        if report.overall.max_overspeed > 0:
+            dispatcher.utter_message(
+                text="At most you were {0:g} km/h over the limit.".format(
+                    report.overall.max_overspeed
                 )
             )
 
@@ -288,11 +330,9 @@ class ActionAnalyseSpeed(Action):
 #         if slot_via is not None:
 #             entity_via = slot_via.append(entity_via)
 
-#         with open(DB, "r", encoding="utf-8") as db:
-#             database = json.load(db)
-
-#         if entity_to in database:
-#             entity_to = database[entity_to]
+#         # saved place e.g. "home"
+#         if entity_to and get_history().place(entity_to):
+#             entity_to = get_history().place(entity_to)
 
 #         if slot_active_route is None:
 #             if entity_to:
@@ -305,9 +345,7 @@ class ActionAnalyseSpeed(Action):
 #                     SlotSet("road_type", entity_road_type),
 #                 ]
 #             else:
-#                 destination = get_frequent_destination(
-#                     json.load(open(DB, "r", encoding="utf-8"))
-#                 )
+#                 destination = get_frequent_destination(tracker.sender_id)
 #                 return [
 #                     SlotSet("destination", destination),
 #                     SlotSet("via", entity_to),
@@ -324,40 +362,6 @@ class ActionAnalyseSpeed(Action):
 #                 SlotSet("route_type", entity_route_type),
 #                 SlotSet("road_type", entity_road_type),
 #             ]
-# def get_frequent_destination(
-#     database, weeks_limit=5, weekly_events_min_count=3, daily_events_min_count=10
-# ):
-#     time_now = datetime.strptime("15.30 30.11.21", "%H.%M %d.%m.%y")  # datetime.now()
-#     weekday_now = time_now.weekday()
-#     hour_now = time_now.hour
-#     time_limit = time_now - timedelta(weeks=weeks_limit)
-#     time_limit = time_limit
-#     destinations_by_day_and_time = Counter()
-#     destinations_by_time = Counter()
-
-#     if "destinations" in database:
-#         for destination in database["destinations"]:
-#             address, trip_date = destination
-#             address = address.lower()
-#             trip_date = datetime.strptime(trip_date, date_string_pattern)
-#             weekday = trip_date.weekday()
-#             hour = trip_date.hour
-
-#             if trip_date >= time_limit:
-#                 if weekday == weekday_now and hour == hour_now:
-#                     destinations_by_day_and_time[address] += 1
-#                 if hour == hour_now:
-#                     destinations_by_time[address] += 1
-
-#     if len(destinations_by_day_and_time) > 0 or len(destinations_by_time) > 0:
-#         top_destination, count = destinations_by_day_and_time.most_common(1)[0]
-#         if count >= weekly_events_min_count:
-#             return top_destination
-#         else:
-#             top_destination, count = destinations_by_time.most_common(1)[0]
-#             if count >= daily_events_min_count:
-#                 return top_destination
-#     return
 # class ActionStartNavigation(Action):
 #     def name(self) -> Text:
 #         return "action_start_navigation"
@@ -379,20 +383,8 @@ class ActionAnalyseSpeed(Action):
 #             if slot_destination and intent == "affirm":
 #                 slot_active_route = slot_destination
 
-#         time_now = datetime.now()
-
-#         # load the current content of database.json
-#         with open(DB, "r", encoding="utf-8") as db:
-#             database = json.load(db)
-
-#         destinations = database.get("destinations", [])
-#         destinations.append(
-#             (slot_active_route, time_now.strftime(date_string_pattern))
-#         )
-#         database.update({"destinations": destinations})
-
-#         with open(DB, "w", encoding="utf-8") as db:
-#             json.dump(database, db)
+#         if slot_active_route:
+#             get_history().add_trip(slot_active_route, tracker.sender_id)
 
 #         return [
 #             SlotSet("active_route", slot_active_route),
@@ -430,12 +422,7 @@ class ActionAnalyseSpeed(Action):
 #             None,
 #         )
 
-#         with open(DB, "r", encoding="utf-8") as db:
-#             database = json.load(db)
-
-#         database.update({entity_db_item_name: entity_location})
-
-#         with open(DB, "w", encoding="utf-8") as db:
-#             json.dump(database, db)
+#         if entity_db_item_name and entity_location:
+#             get_history().save_place(entity_db_item_name, entity_location)
 
 #         return []
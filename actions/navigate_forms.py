@@ -1,24 +1,30 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
 from typing import Any, Dict, List, Text
 from rasa_sdk import Action, FormValidationAction, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import EventType, SlotSet, AllSlotsReset, Restarted
 from rasa_sdk.forms import REQUESTED_SLOT
 from .defaultlog import log
-import random
 from difflib import SequenceMatcher as SM
 import logging
-import pandas as pd
-import os
+
+from .places import get_places, get_position, get_route
+from .navigate import get_history
 
 log = logging.getLogger(__name__)
 
 # text matches must exceed to be considered a match
 MATCH_THRESHOLD = 0.7
 
-# sample list of restaurants from kaggle zomato (see nbs/restaurants.ipynb)
-path = os.path.join(os.path.dirname(__file__), "zomato200.csv")
-df = pd.read_csv(path)
+
+def place_choices(places) -> List[Text]:
+    """ names of places with the locality when a name is shown more than once """
+    counts = Counter(x.name for x in places)
+    choices = [
+        f"{x.name}, {x.locality}" if counts[x.name] > 1 and x.locality else x.name
+        for x in places
+    ]
+    return list(dict.fromkeys(choices))
 
 
 class ValidateNavigateSearchForm(FormValidationAction):
@@ -48,10 +54,18 @@ class ValidateNavigateSearchForm(FormValidationAction):
         log.debug(value)
         log.debug(tracker.slots)
 
-        # todo select by cuisine rather than just prefix the search location_type
-        # simulate getting choice of locations e.g restaurant, pizza
-        rests = df.sample(random.randint(0, 5)).name.values.tolist()
-        choices = [f"{x}" for x in rests]
+        if isinstance(value, list):
+            value = value[-1]
+
+        # along the route if there is one else nearest first if the client sends
+        # its position in the message metadata
+        places = []
+        route = get_route(tracker) if tracker.get_slot("active_route") else None
+        if route:
+            places = get_places().along(route, value or "")
+        if not places:
+            places = get_places().search(value or "", get_position(tracker))
+        choices = place_choices(places)
 
         log.debug(choices)
 
@@ -157,6 +171,7 @@ class SubmitNavigateSearchForm(Action):
 
             # insert into active_route
             active_route.insert(0, tracker.get_slot("destination"))
+            get_history().add_trip(tracker.get_slot("destination"), tracker.sender_id)
 
         return [
             SlotSet("search", None),
@@ -237,6 +252,7 @@ class SubmitNavigateForm(Action):
             if avoiding:
                 dispatcher.utter_message(text=f"exclude points are {avoiding}")
             active_route = [tracker.get_slot("destination")]
+            get_history().add_trip(tracker.get_slot("destination"), tracker.sender_id)
 
         else:
             active_route = None
@@ -0,0 +1,454 @@
+"""
+restaurant search over the kaggle zomato data (docs/zomato.csv)
+
+    built into a binary file by the actions makefile before the image is built
+        python -m actions.places docs/zomato.csv actions/places.bin
+    the action server loads it in a few milliseconds without pandas. if there is no
+    places.bin e.g. running locally it is built from docs/zomato.csv on first use.
+    the image has no docs folder so the docker build fails without places.bin.
+
+    text search uses an inverted index of the words in name, cuisines and locality.
+    places with every word come first then places with most words.
+    nearest first when there is a reference position. the grid index finds places
+    in cells of GRID degrees around it, widening until there are enough.
+    otherwise best rated first. filters on minimum rating and maximum price range.
+
+    along an active route places within CORRIDOR km of the route polyline are
+    ranked by detour i.e. the extra distance to go via the place. the route is
+    simplified and split into segments indexed by finer cells of the corridor
+    width. only the grid cells the corridor passes through are searched and each
+    place is only measured against the segments in its fine cell.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Text, Tuple
+from array import array
+from collections import Counter, defaultdict
+from functools import lru_cache
+from math import asin, ceil, cos, floor, hypot, radians, sin, sqrt
+import csv
+import os
+import pickle
+import re
+import sys
+
+import logging
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+ROOT = os.path.dirname(__file__)
+PLACES = os.path.join(ROOT, "places.bin")
+CSV = os.path.join(ROOT, os.pardir, "docs", "zomato.csv")
+
+# km per degree of latitude
+KM = 111.2
+# about 5km cells
+GRID = 0.05
+# cells searched in each direction before giving up on nearest first
+MAX_RINGS = 40
+# fewer text matches than this are sorted by distance without the grid
+BRUTE_FORCE = 2000
+# km either side of the route
+CORRIDOR = 2.0
+# km a route point can be from the simplified route
+SIMPLIFY = 0.05
+
+STOPWORDS = {
+    "a", "an", "the", "for", "near", "nearby", "me", "some", "any", "to", "in", "of",
+    "place", "places", "restaurant", "restaurants", "food", "find", "somewhere",
+    "and", "with", "go", "eat",
+}
+# words in the search that are filters rather than text
+MAX_PRICE = {"cheap": 2, "budget": 1, "inexpensive": 2, "affordable": 2}
+MIN_RATING = {"good": 3.5, "great": 4.0, "best": 4.0, "top": 4.0, "excellent": 4.5}
+
+
+def tokenize(text: Text) -> List[Text]:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    # pizzas => pizza. not "ss" e.g. "express"
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and w[-2] != "s" else w for w in words]
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """ haversine distance in km """
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 12742 * asin(sqrt(a))
+
+
+def cell(lat: float, lon: float) -> Tuple[int, int]:
+    return floor(lat / GRID), floor(lon / GRID)
+
+
+class Corridor(NamedTuple):
+    """ route prepared for corridor searches. km are on a flat projection. """
+
+    # km per degree of longitude on the route
+    scale: float
+    # degrees of latitude and longitude of the fine cells
+    step: Tuple[float, float]
+    # grid cells within the corridor
+    cells: Set[Tuple[int, int]]
+    # fine cells within the corridor => segments near the cell
+    near: Dict[Tuple[int, int], List[int]]
+    # per segment. ax, ay, dx, dy, squared length and length in km
+    lines: List[Tuple[float, float, float, float, float, float]]
+
+    def segments(self, lat: float, lon: float) -> List[int]:
+        return self.near.get((floor(lat / self.step[0]), floor(lon / self.step[1])), [])
+
+
+def simplify(points: List[Tuple[float, float]], tolerance: float) -> List[int]:
+    """ indexes of the km x, y points to keep so the line moves less than tolerance
+
+    points closer than tolerance to the previous are dropped then douglas-peucker
+    """
+    if len(points) < 3:
+        return list(range(len(points)))
+    radial = [0]
+    for i in range(1, len(points) - 1):
+        x, y = points[radial[-1]]
+        if hypot(points[i][0] - x, points[i][1] - y) > tolerance:
+            radial.append(i)
+    radial.append(len(points) - 1)
+
+    keep = {0, len(radial) - 1}
+    stack = [(0, len(radial) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = points[radial[first]], points[radial[last]]
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        furthest, index = tolerance, None
+        for i in range(first + 1, last):
+            px, py = points[radial[i]][0] - ax, points[radial[i]][1] - ay
+            t = max(0.0, min(1.0, (px * dx + py * dy) / length)) if length else 0.0
+            d = hypot(px - t * dx, py - t * dy)
+            if d > furthest:
+                furthest, index = d, i
+        if index is not None:
+            keep.add(index)
+            stack.extend([(first, index), (index, last)])
+    return [radial[i] for i in sorted(keep)]
+
+
+@lru_cache(maxsize=16)
+def corridor(route: Tuple[Tuple[float, float], ...], width: float) -> Corridor:
+    """ simplify the route, split it into segments no longer than a cell and index
+    the cells within width km of them. cached as the route is the same for a trip.
+    """
+    scale = KM * cos(radians(sum(lat for lat, _ in route) / len(route)))
+    points = [(lon * scale, lat * KM) for lat, lon in route]
+    route = [route[i] for i in simplify(points, min(SIMPLIFY, width / 10))]
+    pairs = list(zip(route, route[1:])) or [(route[0], route[0])]
+
+    # fine cells are width km so a place is only checked against nearby segments
+    step = width / KM, width / max(0.1, scale)
+    cells = set()
+    near = defaultdict(list)
+    lines = []
+    for a, b in pairs:
+        n = max(1, ceil(max(abs(b[0] - a[0]), abs(b[1] - a[1])) / GRID))
+        split = [
+            (a[0] + (b[0] - a[0]) * i / n, a[1] + (b[1] - a[1]) * i / n)
+            for i in range(n + 1)
+        ]
+        for (alat, alon), (blat, blon) in zip(split, split[1:]):
+            south, north = min(alat, blat) - step[0], max(alat, blat) + step[0]
+            west, east = min(alon, blon) - step[1], max(alon, blon) + step[1]
+            for r in range(floor(south / GRID), floor(north / GRID) + 1):
+                for c in range(floor(west / GRID), floor(east / GRID) + 1):
+                    cells.add((r, c))
+            for r in range(floor(south / step[0]), floor(north / step[0]) + 1):
+                for c in range(floor(west / step[1]), floor(east / step[1]) + 1):
+                    near[r, c].append(len(lines))
+            dx, dy = (blon - alon) * scale, (blat - alat) * KM
+            lines.append(
+                (alon * scale, alat * KM, dx, dy, dx * dx + dy * dy, hypot(dx, dy))
+            )
+    return Corridor(scale, step, cells, dict(near), lines)
+
+
+class Place(NamedTuple):
+    name: Text
+    locality: Text
+    cuisines: Text
+    rating: float
+    price: int
+    lat: Optional[float]
+    lon: Optional[float]
+    distance: Optional[float] = None
+    # extra km to go via the place on the active route
+    detour: Optional[float] = None
+
+
+def build(path: Text = CSV) -> Dict[Text, Any]:
+    """ return the index data from the zomato csv """
+    data = dict(
+        version=VERSION,
+        name=[],
+        locality=[],
+        cuisines=[],
+        rating=array("f"),
+        price=array("b"),
+        votes=array("i"),
+        lat=array("d"),
+        lon=array("d"),
+    )
+    words = defaultdict(list)
+    grid = defaultdict(list)
+    with open(path, encoding="latin-1", newline="") as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            data["name"].append(row["Restaurant Name"])
+            data["locality"].append(row["Locality"])
+            data["cuisines"].append(row["Cuisines"])
+            data["rating"].append(float(row["Aggregate rating"] or 0))
+            data["price"].append(int(row["Price range"] or 0))
+            data["votes"].append(int(row["Votes"] or 0))
+            lat, lon = float(row["Latitude"] or 0), float(row["Longitude"] or 0)
+            data["lat"].append(lat)
+            data["lon"].append(lon)
+            text = " ".join([row["Restaurant Name"], row["Cuisines"], row["Locality"]])
+            for word in set(tokenize(text)):
+                words[word].append(i)
+            # 0, 0 is missing
+            if lat or lon:
+                grid[cell(lat, lon)].append(i)
+    data["words"] = {k: array("I", v) for k, v in words.items()}
+    data["grid"] = {k: array("I", v) for k, v in grid.items()}
+    return data
+
+
+def save(data: Dict[Text, Any], path: Text = PLACES) -> None:
+    with open(path, "wb") as f:
+        pickle.dump(data, f, protocol=4)
+
+
+class Places:
+    def __init__(self, data: Dict[Text, Any]):
+        if data.get("version") != VERSION:
+            raise ValueError(f"places index version {data.get('version')} not {VERSION}")
+        self.__dict__.update(data)
+
+    @classmethod
+    def load(cls, path: Text = PLACES, csv_path: Text = CSV) -> "Places":
+        try:
+            with open(path, "rb") as f:
+                return cls(pickle.load(f))
+        except (OSError, ValueError) as e:
+            if not os.path.exists(csv_path):
+                raise FileNotFoundError(
+                    f"no places index {path} and no {csv_path} to build it from. "
+                    "run make places in actions before building the image"
+                ) from e
+            log.warning(f"building places index from {csv_path}. {e}")
+            return cls(build(csv_path))
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    def place(
+        self,
+        i: int,
+        position: Optional[Tuple[float, float]] = None,
+        detour: Optional[float] = None,
+    ) -> Place:
+        lat, lon = self.lat[i], self.lon[i]
+        located = bool(lat or lon)
+        return Place(
+            self.name[i],
+            self.locality[i],
+            self.cuisines[i],
+            round(self.rating[i], 1),
+            self.price[i],
+            lat if located else None,
+            lon if located else None,
+            round(distance(*position, lat, lon), 2) if position and located else None,
+            None if detour is None else round(detour, 2),
+        )
+
+    def match(self, words: List[Text]) -> Optional[Set[int]]:
+        """ places with every word else the most words. None is no text filter. """
+        if not words:
+            return None
+        found = [set(self.words.get(w, ())) for w in words]
+        found = [ids for ids in found if ids]
+        if not found:
+            return set()
+        ids = set.intersection(*found)
+        if ids:
+            return ids
+        counts = Counter(i for ids in found for i in ids)
+        most = max(counts.values())
+        return {i for i, n in counts.items() if n == most}
+
+    def allowed(self, i: int, min_rating: Optional[float], max_price: Optional[int]):
+        if min_rating is not None and self.rating[i] < min_rating:
+            return False
+        if max_price is not None and self.price[i] > max_price:
+            return False
+        return True
+
+    def nearest(self, position, ids, limit, min_rating, max_price) -> List[int]:
+        """ nearest first by searching rings of cells around the position """
+        lat, lon = position
+        if ids is not None and len(ids) <= BRUTE_FORCE:
+            found = [
+                (distance(lat, lon, self.lat[i], self.lon[i]), i)
+                for i in ids
+                if (self.lat[i] or self.lon[i])
+                and self.allowed(i, min_rating, max_price)
+            ]
+            return [i for _, i in sorted(found)[:limit]]
+
+        row, col = cell(lat, lon)
+        found = []
+        for ring in range(MAX_RINGS + 1):
+            cells = [
+                (row + r, col + c)
+                for r in range(-ring, ring + 1)
+                for c in range(-ring, ring + 1)
+                if max(abs(r), abs(c)) == ring
+            ]
+            for key in cells:
+                for i in self.grid.get(key, ()):
+                    if (ids is None or i in ids) and self.allowed(i, min_rating, max_price):
+                        found.append((distance(lat, lon, self.lat[i], self.lon[i]), i))
+            # places in further rings are at least ring * GRID degrees away
+            found.sort()
+            reach = ring * GRID * KM * min(1, cos(radians(lat)))
+            if len(found) >= limit and found[limit - 1][0] <= reach:
+                break
+        return [i for _, i in found[:limit]]
+
+    def parse(self, query: Text, min_rating: Optional[float], max_price: Optional[int]):
+        """ return text words and the filters. filter words e.g. "cheap" set filters. """
+        words = []
+        for word in tokenize(query):
+            if word in MAX_PRICE:
+                max_price = min(max_price or 4, MAX_PRICE[word])
+            elif word in MIN_RATING:
+                min_rating = max(min_rating or 0, MIN_RATING[word])
+            elif word not in STOPWORDS:
+                words.append(word)
+        return words, min_rating, max_price
+
+    def search(
+        self,
+        query: Text = "",
+        position: Optional[Tuple[float, float]] = None,
+        min_rating: Optional[float] = None,
+        max_price: Optional[int] = None,
+        limit: int = 5,
+    ) -> List[Place]:
+        """ places matching the query """
+        words, min_rating, max_price = self.parse(query, min_rating, max_price)
+        ids = self.match(words)
+        if ids is not None and not ids:
+            return []
+
+        found = []
+        if position:
+            found = self.nearest(position, ids, limit, min_rating, max_price)
+        # no position or nothing located nearby
+        if not found:
+            candidates = range(len(self)) if ids is None else ids
+            found = sorted(
+                (i for i in candidates if self.allowed(i, min_rating, max_price)),
+                key=lambda i: (-self.rating[i], -self.votes[i]),
+            )[:limit]
+        return [self.place(i, position) for i in found]
+
+    def along(
+        self,
+        route: List[Tuple[float, float]],
+        query: Text = "",
+        width: float = CORRIDOR,
+        min_rating: Optional[float] = None,
+        max_price: Optional[int] = None,
+        limit: int = 5,
+    ) -> List[Place]:
+        """ places matching the query within width km of the route. least detour first. """
+        if not route:
+            return []
+        words, min_rating, max_price = self.parse(query, min_rating, max_price)
+        ids = self.match(words)
+        if ids is not None and not ids:
+            return []
+        route = corridor(tuple(route), width)
+        if ids is not None and len(ids) <= BRUTE_FORCE:
+            candidates = ids
+        else:
+            candidates = (
+                i
+                for key in route.cells
+                for i in self.grid.get(key, ())
+                if ids is None or i in ids
+            )
+
+        found = []
+        for i in candidates:
+            lat, lon = self.lat[i], self.lon[i]
+            segments = route.segments(lat, lon)
+            if not segments or not self.allowed(i, min_rating, max_price):
+                continue
+            x, y = lon * route.scale, lat * KM
+            best = None
+            for s in segments:
+                ax, ay, dx, dy, length, ab = route.lines[s]
+                px, py = x - ax, y - ay
+                t = max(0.0, min(1.0, (px * dx + py * dy) / length)) if length else 0.0
+                if hypot(px - t * dx, py - t * dy) > width:
+                    continue
+                # via the place instead of straight along the segment
+                detour = hypot(px, py) + hypot(px - dx, py - dy) - ab
+                if best is None or detour < best:
+                    best = detour
+            if best is not None:
+                found.append((best, -self.rating[i], i))
+        found.sort()
+        return [self.place(i, detour=detour) for detour, _, i in found[:limit]]
+
+
+@lru_cache(maxsize=None)
+def get_places() -> Places:
+    """ load on first use """
+    return Places.load()
+
+
+def get_position(tracker) -> Optional[Tuple[float, float]]:
+    """ position of the user from the message metadata
+
+    e.g. {"location": {"lat": 28.63, "lon": 77.22}}
+    """
+    metadata = tracker.latest_message.get("metadata") or {}
+    location = metadata.get("location") or {}
+    try:
+        return float(location["lat"]), float(location["lon"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_route(tracker) -> Optional[List[Tuple[float, float]]]:
+    """ polyline of the active route from the message metadata
+
+    e.g. {"route": [[28.63, 77.22], [28.55, 77.25]]} or a list of {"lat", "lon"}
+    """
+    metadata = tracker.latest_message.get("metadata") or {}
+    try:
+        route = [
+            (float(p["lat"]), float(p["lon"]))
+            if isinstance(p, dict)
+            else (float(p[0]), float(p[1]))
+            for p in metadata.get("route") or []
+        ]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return route or None
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else CSV
+    target = sys.argv[2] if len(sys.argv) > 2 else PLACES
+    data = build(source)
+    save(data, target)
+    log.info(f"saved {len(data['name'])} places to {target}")
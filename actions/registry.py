@@ -0,0 +1,121 @@
+"""
+lazy registry of actions for fast action server startup
+
+    start the action server with this module rather than the package
+        rasa run actions --actions actions.registry
+    action names are known up front. each action module and its resources
+    e.g. restaurant data, spotify client are loaded on the first call to one of its
+    actions.
+
+    ACTIONS_WARMUP=weather_handler,cancel (or all) loads modules in the background
+    new actions must be added to ACTIONS
+"""
+from typing import Any, Dict, List, Text
+import importlib
+import inspect
+import os
+from threading import Lock, Thread
+
+from rasa_sdk import Action, Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# action name => module.class relative to the actions package
+ACTIONS = {
+    "action_check_distance_to_destination": "navigate.ActionCheckDistance",
+    "action_check_time_to_destination": "navigate.ActionCheckTime",
+    "action_stop_navigation": "navigate.ActionStopNavigation",
+    "action_analyse_speed": "navigate.ActionAnalyseSpeed",
+    "validate_navigate_search_form": "navigate_forms.ValidateNavigateSearchForm",
+    "submit_navigate_search_form": "navigate_forms.SubmitNavigateSearchForm",
+    "validate_navigate_form": "navigate_forms.ValidateNavigateForm",
+    "submit_navigate_form": "navigate_forms.SubmitNavigateForm",
+    "weather_handler": "weather.Weather",
+    "weather_handler_temperature": "weather.WeatherTemperature",
+    "validate_music_play_form": "music.ValidateMusicPlayForm",
+    "submit_music_play_form": "music.SubmitMusicPlayForm",
+    "validate_call_make_form": "CallAndMessage.call.ValidateCallMakeForm",
+    "submit_call_make_form": "CallAndMessage.call.SubmitCallMakeForm",
+    "validate_message_send_form": "CallAndMessage.message.ValidateMessageSendForm",
+    "submit_message_send_form": "CallAndMessage.message.SubmitMessageSendForm",
+    "cancel": "user.Cancel",
+    "action_set_user_feats": "user.ActionSetUserFeats",
+    "action_reprompt": "user.ActionReprompt",
+}
+
+_loaded: Dict[Text, Action] = {}
+_lock = Lock()
+
+
+def get_action(name: Text) -> Action:
+    """ import the module for an action and return an instance """
+    action = _loaded.get(name)
+    if action is None:
+        with _lock:
+            action = _loaded.get(name)
+            if action is None:
+                module, cls = ACTIONS[name].rsplit(".", 1)
+                module = importlib.import_module(f".{module}", __package__)
+                action = getattr(module, cls)()
+                _loaded[name] = action
+                log.info(f"loaded action {name}")
+    return action
+
+
+def _name(self) -> Text:
+    return self.action_name
+
+
+async def _run(
+    self,
+    dispatcher: CollectingDispatcher,
+    tracker: Tracker,
+    domain: Dict[Text, Any],
+) -> List[Dict[Text, Any]]:
+    """ run the action. imported on the first run. """
+    events = get_action(self.action_name).run(dispatcher, tracker, domain)
+    if inspect.isawaitable(events):
+        events = await events
+    return events
+
+
+# one subclass of Action per action as rasa_sdk registers each subclass. no shared
+# base class as that would be registered too. kept here as __subclasses__ only has
+# weak references so the classes would otherwise be garbage collected.
+LAZY_ACTIONS: Dict[Text, type] = {
+    _action_name: type(
+        f"Lazy_{_action_name}",
+        (Action,),
+        dict(action_name=_action_name, name=_name, run=_run),
+    )
+    for _action_name in ACTIONS
+}
+
+
+def warmup(names: List[Text]) -> None:
+    for name in names:
+        try:
+            get_action(name)
+        except Exception:
+            log.exception(f"failed to warm up {name}")
+
+
+def reset_session() -> None:
+    """ only keep conversations from current session """
+    root = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+    try:
+        os.remove(f"{root}/rasa.db")
+        log.warning("deleted rasa.db")
+    except Exception as e:
+        log.exception("failed to delete rasa.db")
+
+
+reset_session()
+
+_warmup = os.environ.get("ACTIONS_WARMUP", "")
+if _warmup:
+    _names = list(ACTIONS) if _warmup == "all" else _warmup.split(",")
+    Thread(target=warmup, args=(_names,), daemon=True).start()
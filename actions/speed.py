@@ -0,0 +1,371 @@
+"""
+speed compliance analytics with numpy
+
+    samples are (speed limit, actual speed) pairs e.g. logged every minute.
+    each sample goes in the first zone whose limit is at least the speed limit.
+    the last zone has no upper limit. e.g. with the default ZONES a 50 km/h limit
+    is "town" and 100 km/h is "highway". old style zones without an unbounded zone
+    e.g. {"danger": 30, "town": 60} get "highway" above the last limit.
+
+    samples are read in chunks of CHUNK so memory stays flat for long trip logs
+    including numpy memmaps. each chunk is one pass of vectorized operations
+        zone of each sample with searchsorted
+        histogram of speed over the limit per zone with a single bincount
+        sums and compliant counts per zone with weighted bincount
+    percentiles come from the histograms which have RESOLUTION km/h bins and cover
+    +-MAX_DIFF km/h. max overspeed is exact.
+
+    SpeedAccumulator keeps these totals as (timestamp, limit, speed) samples arrive
+    so reports for a window are the same cost however much driving there was
+        today       reset when the local date changes
+        trip        since the last gap of TRIP_GAP seconds
+        hour        a histogram per minute for the last hour with a running total
+    snapshotted to json at most every SNAPSHOT_EVERY seconds and on save()
+"""
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Sequence, Text, Tuple
+from datetime import date
+from threading import Lock
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# zone => highest speed limit in the zone. in increasing order.
+ZONES = {"danger": 30, "town": 60, "highway": float("inf")}
+CHUNK = 1 << 18
+PERCENTILES = (50, 90, 95, 99)
+# km/h over or under the limit covered by the histogram. beyond are clipped.
+MAX_DIFF = 250
+RESOLUTION = 1
+
+# seconds without samples that end a trip
+TRIP_GAP = 10 * 60
+# minutes in the hour window
+HOUR = 60
+SNAPSHOT = "dbtest/speed.json"
+SNAPSHOT_EVERY = 60
+
+
+class ZoneStats(NamedTuple):
+    samples: int
+    # km/h over the limit on average. negative is under.
+    average_diff: Optional[float]
+    # percent of samples at or below the limit
+    percent_correct: Optional[float]
+    # most km/h over the limit. negative if always under.
+    max_overspeed: Optional[float]
+    # percentile => km/h over the limit
+    percentiles: Dict[int, float]
+    # sum of km/h over the limit. average_diff unrounded is total_diff / samples.
+    total_diff: float = 0.0
+
+
+class SpeedReport(NamedTuple):
+    overall: ZoneStats
+    zones: Dict[Text, ZoneStats]
+
+
+def check_zones(zones: Dict[Text, float]) -> Dict[Text, float]:
+    """ zones in increasing order ending with a zone with no upper limit """
+    limits = list(zones.values())
+    if any(low >= high for low, high in zip(limits, limits[1:])):
+        raise ValueError(f"zone limits must be increasing {zones}")
+    if limits and limits[-1] == float("inf"):
+        return zones
+    if "highway" in zones:
+        raise ValueError(f"last zone must have no upper limit {zones}")
+    return dict(zones, highway=float("inf"))
+
+
+class SpeedHistogram:
+    """ running totals per zone that samples are added to in chunks """
+
+    def __init__(self, zones: Dict[Text, float] = ZONES):
+        zones = check_zones(zones)
+        self.names = list(zones)
+        self.limits = np.array(list(zones.values())[:-1], dtype=np.float64)
+        self.bins = int(2 * MAX_DIFF / RESOLUTION) + 1
+        self.counts = np.zeros((len(self.names), self.bins), dtype=np.int64)
+        self.sums = np.zeros(len(self.names))
+        self.correct = np.zeros(len(self.names), dtype=np.int64)
+        self.maxes = np.full(len(self.names), -np.inf)
+
+    def add(self, limits: Sequence[float], speeds: Sequence[float]) -> None:
+        """ add samples. any sequence, array or memmap. extra samples are ignored. """
+        for start in range(0, min(len(limits), len(speeds)), CHUNK):
+            self.add_chunk(
+                np.asarray(limits[start : start + CHUNK], dtype=np.float64),
+                np.asarray(speeds[start : start + CHUNK], dtype=np.float64),
+            )
+
+    def add_chunk(self, limits: np.ndarray, speeds: np.ndarray) -> None:
+        valid = np.isfinite(limits) & np.isfinite(speeds)
+        if not valid.all():
+            # gaps in the telemetry
+            limits, speeds = limits[valid], speeds[valid]
+        if not len(limits):
+            return
+        n = len(self.names)
+        zone = np.searchsorted(self.limits, limits, side="left")
+        diff = speeds - limits
+        index = np.rint(np.clip(diff, -MAX_DIFF, MAX_DIFF) / RESOLUTION).astype(np.int64)
+        index += zone * self.bins + self.bins // 2
+        self.counts += np.bincount(index, minlength=n * self.bins).reshape(n, -1)
+        self.sums += np.bincount(zone, weights=diff, minlength=n)
+        self.correct += np.bincount(zone[diff <= 0], minlength=n)
+        for z in np.flatnonzero(np.bincount(zone, minlength=n)):
+            self.maxes[z] = max(self.maxes[z], diff[zone == z].max())
+
+    def merge(self, other: "SpeedHistogram") -> None:
+        self.counts += other.counts
+        self.sums += other.sums
+        self.correct += other.correct
+        self.maxes = np.maximum(self.maxes, other.maxes)
+
+    def subtract(self, other: "SpeedHistogram") -> None:
+        """ remove samples merged earlier. maxes cannot be removed. """
+        self.counts -= other.counts
+        self.sums -= other.sums
+        self.correct -= other.correct
+
+    def clear(self) -> None:
+        self.counts[:] = 0
+        self.sums[:] = 0
+        self.correct[:] = 0
+        self.maxes[:] = -np.inf
+
+    @property
+    def samples(self) -> int:
+        return int(self.counts.sum())
+
+    def to_dict(self) -> Dict[Text, Any]:
+        """ json serializable. the histogram is sparse. """
+        index = np.flatnonzero(self.counts)
+        return dict(
+            index=index.tolist(),
+            counts=self.counts.ravel()[index].tolist(),
+            sums=self.sums.tolist(),
+            correct=self.correct.tolist(),
+            maxes=[None if np.isinf(x) else float(x) for x in self.maxes],
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any], zones: Dict[Text, float] = ZONES):
+        histogram = cls(zones)
+        histogram.counts.ravel()[data["index"]] = data["counts"]
+        histogram.sums[:] = data["sums"]
+        histogram.correct[:] = data["correct"]
+        histogram.maxes[:] = [-np.inf if x is None else x for x in data["maxes"]]
+        return histogram
+
+    def stats(self, counts: np.ndarray, total: float, correct: int, most: float):
+        samples = int(counts.sum())
+        if not samples:
+            return ZoneStats(0, None, None, None, {})
+        # nearest rank on the cumulative histogram
+        ranks = np.ceil(np.array(PERCENTILES) / 100 * samples).astype(np.int64)
+        index = np.searchsorted(np.cumsum(counts), np.maximum(ranks, 1))
+        values = (index - self.bins // 2) * RESOLUTION
+        return ZoneStats(
+            samples,
+            round(float(total) / samples, 2),
+            round(int(correct) * 100 / samples, 2),
+            round(float(most), 2),
+            {p: float(v) for p, v in zip(PERCENTILES, values)},
+            float(total),
+        )
+
+    def report(self) -> SpeedReport:
+        zones = {
+            name: self.stats(
+                self.counts[z], self.sums[z], self.correct[z], self.maxes[z]
+            )
+            for z, name in enumerate(self.names)
+        }
+        overall = self.stats(
+            self.counts.sum(axis=0),
+            self.sums.sum(),
+            self.correct.sum(),
+            self.maxes.max(),
+        )
+        return SpeedReport(overall, {k: v for k, v in zones.items() if v.samples})
+
+
+def analyse(
+    limits: Sequence[float],
+    speeds: Sequence[float],
+    zones: Dict[Text, float] = ZONES,
+) -> SpeedReport:
+    """ report on speed limit compliance overall and per zone """
+    histogram = SpeedHistogram(zones)
+    histogram.add(limits, speeds)
+    return histogram.report()
+
+
+def analyse_chunks(
+    chunks: Iterable[Tuple[Sequence[float], Sequence[float]]],
+    zones: Dict[Text, float] = ZONES,
+) -> SpeedReport:
+    """ report for (limits, speeds) chunks e.g. read from a trip log """
+    histogram = SpeedHistogram(zones)
+    for limits, speeds in chunks:
+        histogram.add(limits, speeds)
+    return histogram.report()
+
+
+class SpeedAccumulator:
+    """ running totals for today, the last trip and the last hour """
+
+    def __init__(self, zones: Dict[Text, float] = ZONES, path: Optional[Text] = None):
+        zones = check_zones(zones)
+        self.zones = zones
+        self.path = path
+        self.lock = Lock()
+        self.saved = time.time()
+        # local date of today
+        self.day: Optional[date] = None
+        self.today = SpeedHistogram(zones)
+        self.trip = SpeedHistogram(zones)
+        self.trip_start: Optional[float] = None
+        # timestamp of the latest sample
+        self.last: Optional[float] = None
+        # minute since the epoch => histogram for the last HOUR minutes
+        self.minutes: Dict[int, SpeedHistogram] = {}
+        self.hour = SpeedHistogram(zones)
+
+    def record(self, timestamp: float, limit: float, speed: float) -> None:
+        self.record_chunk([timestamp], [limit], [speed])
+
+    def record_chunk(
+        self,
+        timestamps: Sequence[float],
+        limits: Sequence[float],
+        speeds: Sequence[float],
+    ) -> None:
+        """ add samples in time order. split by minute and trip. """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        limits = np.asarray(limits, dtype=np.float64)
+        speeds = np.asarray(speeds, dtype=np.float64)
+        if not len(timestamps):
+            return
+        minute = np.floor(timestamps / 60)
+        gap = np.diff(timestamps) > TRIP_GAP
+        starts = np.flatnonzero((np.diff(minute) != 0) | gap) + 1
+        bounds = [0, *starts.tolist(), len(timestamps)]
+        with self.lock:
+            for start, end in zip(bounds, bounds[1:]):
+                self.add(timestamps[start:end], limits[start:end], speeds[start:end])
+        if self.path and time.time() - self.saved > SNAPSHOT_EVERY:
+            self.save()
+
+    def add(self, timestamps: np.ndarray, limits: np.ndarray, speeds: np.ndarray):
+        """ samples in the same minute and trip """
+        first = float(timestamps[0])
+        chunk = SpeedHistogram(self.zones)
+        chunk.add_chunk(limits, speeds)
+
+        day = date.fromtimestamp(first)
+        if self.day is None or day > self.day:
+            self.day = day
+            self.today.clear()
+        if day == self.day:
+            self.today.merge(chunk)
+
+        if self.last is None or first - self.last > TRIP_GAP:
+            self.trip.clear()
+            self.trip_start = first
+        self.trip.merge(chunk)
+        self.last = max(self.last or first, float(timestamps[-1]))
+
+        minute = int(first // 60)
+        if minute > self.latest_minute() - HOUR:
+            if minute in self.minutes:
+                self.minutes[minute].merge(chunk)
+            else:
+                self.minutes[minute] = chunk
+            self.hour.merge(chunk)
+            self.expire(self.latest_minute())
+
+    def latest_minute(self) -> int:
+        return int(self.last // 60) if self.last is not None else 0
+
+    def expire(self, minute: int) -> None:
+        """ drop minutes more than an hour before minute """
+        for old in [m for m in self.minutes if m <= minute - HOUR]:
+            self.hour.subtract(self.minutes.pop(old))
+
+    def report(self, window: Text = "today", now: Optional[float] = None) -> SpeedReport:
+        """ report for "today", "trip" or "hour" ending now """
+        now = time.time() if now is None else now
+        with self.lock:
+            if window == "today":
+                if self.day != date.fromtimestamp(now):
+                    return SpeedHistogram(self.zones).report()
+                return self.today.report()
+            if window == "trip":
+                return self.trip.report()
+            if window == "hour":
+                self.expire(int(now // 60))
+                # maxes are not subtracted so come from the minutes
+                maxes = [m.maxes for m in self.minutes.values()]
+                self.hour.maxes = (
+                    np.max(maxes, axis=0) if maxes else np.full(len(self.zones), -np.inf)
+                )
+                return self.hour.report()
+        raise ValueError(f"unknown window {window}")
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return dict(
+            version=1,
+            zones=list(self.zones),
+            limits=list(self.zones.values())[:-1],
+            day=self.day.isoformat() if self.day else None,
+            last=self.last,
+            trip_start=self.trip_start,
+            today=self.today.to_dict(),
+            trip=self.trip.to_dict(),
+            minutes={str(k): v.to_dict() for k, v in self.minutes.items()},
+        )
+
+    def save(self, path: Optional[Text] = None) -> None:
+        """ write a snapshot. replaces the file so readers never see a partial one. """
+        path = path or self.path
+        with self.lock:
+            data = self.to_dict()
+            self.saved = time.time()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Text = SNAPSHOT, zones: Dict[Text, float] = ZONES):
+        """ from a snapshot if there is one for the same zones else empty """
+        accumulator = cls(zones, path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return accumulator
+        zones = accumulator.zones
+        limits = list(zones.values())[:-1]
+        if data.get("zones") != list(zones) or data.get("limits") != limits:
+            log.warning(f"ignoring speed snapshot {path} for different zones")
+            return accumulator
+        accumulator.day = date.fromisoformat(data["day"]) if data["day"] else None
+        accumulator.last = data["last"]
+        accumulator.trip_start = data["trip_start"]
+        accumulator.today = SpeedHistogram.from_dict(data["today"], zones)
+        accumulator.trip = SpeedHistogram.from_dict(data["trip"], zones)
+        for minute, histogram in data["minutes"].items():
+            histogram = SpeedHistogram.from_dict(histogram, zones)
+            accumulator.minutes[int(minute)] = histogram
+            accumulator.hour.merge(histogram)
+        return accumulator
@@ -0,0 +1,142 @@
+"""
+resolve the time slot to a number of days from today
+
+    iso dates from duckling or enzo e.g. "2021-12-01T00:00:00.000+00:00" are read
+    directly. common relative expressions e.g. "tomorrow", "friday", "in 3 days"
+    use precompiled regex. anything else falls back to ctparse with a timeout
+    and a limit on the rule stack depth.
+    results are memoized by (expression, reference day)
+    the surface text e.g. "tomorrow" is taken from the time entity of the latest
+    message so replies can use the user's words rather than a date.
+"""
+from typing import Optional, Text, Tuple
+from datetime import date, datetime
+from functools import lru_cache
+import re
+
+from ctparse import ctparse
+from ctparse.types import Interval
+from rasa_sdk import Tracker
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# extractors that return duckling format time entities
+DUCKLING_EXTRACTORS = ["DucklingEntityExtractor", "EnzoEntityExtractor"]
+
+# seconds allowed for ctparse
+CTPARSE_TIMEOUT = 0.2
+CTPARSE_MAX_STACK_DEPTH = 6
+
+ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+NUMBERS = dict(
+    a=1, an=1, one=1, two=2, three=3, four=4, five=5, six=6, seven=7, eight=8, nine=9, ten=10
+)
+FIXED = {
+    "now": 0,
+    "today": 0,
+    "tonight": 0,
+    "this morning": 0,
+    "this afternoon": 0,
+    "this evening": 0,
+    "tomorrow": 1,
+    "tomorrow morning": 1,
+    "tomorrow afternoon": 1,
+    "tomorrow evening": 1,
+    "tomorrow night": 1,
+    "day after tomorrow": 2,
+    "the day after tomorrow": 2,
+    "yesterday": -1,
+    "next week": 7,
+}
+RELATIVE = re.compile(
+    r"^(?:(?P<fixed>{fixed})"
+    r"|(?P<which>this |next |on )?(?P<weekday>{weekdays})"
+    r"|in (?P<n>\d+|{numbers}) (?P<unit>days?|weeks?))$".format(
+        fixed="|".join(sorted(FIXED, key=len, reverse=True)),
+        weekdays="|".join(WEEKDAYS),
+        numbers="|".join(NUMBERS),
+    )
+)
+
+
+def fast_delta(expression: Text, today: date) -> Optional[int]:
+    """ days from today for common relative expressions else None """
+    match = RELATIVE.match(expression)
+    if match is None:
+        return None
+    if match["fixed"]:
+        return FIXED[match["fixed"]]
+    if match["weekday"]:
+        delta = (WEEKDAYS.index(match["weekday"]) - today.weekday()) % 7
+        if match["which"] == "next " and delta == 0:
+            delta = 7
+        return delta
+    n = int(match["n"]) if match["n"].isdigit() else NUMBERS[match["n"]]
+    return n * 7 if match["unit"].startswith("week") else n
+
+
+def ctparse_delta(expression: Text, today: date) -> Optional[int]:
+    try:
+        parsed = ctparse(
+            expression,
+            ts=datetime.combine(today, datetime.min.time()),
+            timeout=CTPARSE_TIMEOUT,
+            max_stack_depth=CTPARSE_MAX_STACK_DEPTH,
+            latent_time=False,
+        )
+    except Exception:
+        log.exception(f"ctparse failed for {expression}")
+        return None
+    if parsed is None:
+        return None
+    resolution = parsed.resolution
+    if isinstance(resolution, Interval):
+        resolution = resolution.t_from or resolution.t_to
+    try:
+        return (date(resolution.year, resolution.month, resolution.day) - today).days
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _delta(expression: Text, today: date) -> Optional[int]:
+    match = ISO_DATE.match(expression)
+    if match:
+        try:
+            return (date(*map(int, match.groups())) - today).days
+        except ValueError:
+            return None
+    normalized = " ".join(expression.lower().split())
+    delta = fast_delta(normalized, today)
+    if delta is None:
+        delta = ctparse_delta(normalized, today)
+    return delta
+
+
+def time_delta(time: Optional[Text], today: Optional[date] = None) -> Optional[int]:
+    """ days from today or None if not understood. no time is today. """
+    if not time:
+        return 0
+    return _delta(str(time), today or date.today())
+
+
+def time_text(time: Optional[Text], tracker: Tracker) -> Text:
+    """ original text of the time entity e.g. "tomorrow" rather than a date """
+    entities = [
+        e for e in tracker.latest_message.get("entities", []) if e["entity"] == "time"
+    ]
+    if not entities:
+        return time or "today"
+    entity = entities[-1]
+    if entity.get("extractor") not in DUCKLING_EXTRACTORS:
+        log.warning("time was not extracted by duckling")
+    return entity.get("text", "time")
+
+
+def resolve_time(time: Optional[Text], tracker: Tracker) -> Tuple[Optional[int], Text]:
+    """ return days from today and the surface text """
+    return time_delta(time), time_text(time, tracker)
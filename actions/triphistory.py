@@ -0,0 +1,195 @@
+"""
+trip history and saved places in sqlite
+
+    trips are only ever inserted. frequent destinations are counted in sql using
+    the (sender, weekday, hour) index and visits to a destination use the
+    destination index so neither gets slower with the size of the history.
+    WAL mode so many action worker processes can read while one writes. each
+    thread has its own connection. writers wait up to BUSY_TIMEOUT for the lock.
+
+    the json database (dbtest/navigate.json) is migrated once on first use
+        "destinations": [[address, "%H.%M %d.%m.%y"], ...] are trips
+            it has no senders so these trips are shared history for every sender
+        any other key with a string value is a saved place
+"""
+from typing import List, Optional, Text
+from datetime import datetime, timedelta
+from threading import local
+import json
+import os
+import sqlite3
+
+import logging
+
+log = logging.getLogger(__name__)
+
+HISTORY = "dbtest/triphistory.db"
+BUSY_TIMEOUT = 5
+# date format in the json database
+DATE_PATTERN = "%H.%M %d.%m.%y"
+
+SCHEMA = """
+create table if not exists trip (
+    id integer primary key,
+    sender text,
+    destination text not null,
+    started real not null,
+    weekday integer not null,
+    hour integer not null
+);
+create index if not exists trip_sender_weekday_hour
+    on trip (sender, weekday, hour, started);
+create index if not exists trip_destination on trip (destination, started);
+create table if not exists place (name text primary key, location text not null);
+create table if not exists meta (key text primary key, value text);
+"""
+
+# same hour on any day. lets sqlite use the (sender, weekday, hour) index.
+ANY_WEEKDAY = "weekday in (0, 1, 2, 3, 4, 5, 6)"
+# trips of the sender plus shared trips with no sender
+SENDER = "(sender = ? or sender is null)"
+
+
+def normalize(value: Text) -> Text:
+    return " ".join(value.lower().split())
+
+
+class TripHistory:
+    def __init__(self, path: Text = HISTORY):
+        self.path = path
+        self.local = local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.db as db:
+            db.executescript(SCHEMA)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """ connection for this thread and process """
+        pid, db = getattr(self.local, "db", (None, None))
+        if pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            db.execute("pragma journal_mode=wal")
+            db.execute("pragma synchronous=normal")
+            self.local.db = os.getpid(), db
+        return db
+
+    def add_trip(
+        self,
+        destination: Text,
+        sender: Optional[Text] = None,
+        when: Optional[datetime] = None,
+    ) -> None:
+        when = when or datetime.now()
+        with self.db as db:
+            db.execute(
+                "insert into trip (sender, destination, started, weekday, hour) "
+                "values (?, ?, ?, ?, ?)",
+                (
+                    sender,
+                    normalize(destination),
+                    when.timestamp(),
+                    when.weekday(),
+                    when.hour,
+                ),
+            )
+
+    def top(self, where: Text, args: tuple) -> Optional[tuple]:
+        """ (destination, count) with the most trips matching where """
+        return self.db.execute(
+            f"select destination, count(*) as n from trip where {where} "
+            "group by destination order by n desc, max(started) desc limit 1",
+            args,
+        ).fetchone()
+
+    def frequent_destination(
+        self,
+        sender: Optional[Text] = None,
+        now: Optional[datetime] = None,
+        weeks_limit: int = 5,
+        weekly_events_min_count: int = 3,
+        daily_events_min_count: int = 10,
+    ) -> Optional[Text]:
+        """ where the sender usually goes at this time including shared trips
+
+        most trips on the same weekday and hour in the last weeks_limit weeks if
+        there are at least weekly_events_min_count else most trips at the same hour
+        on any day if there are at least daily_events_min_count
+        """
+        now = now or datetime.now()
+        since = (now - timedelta(weeks=weeks_limit)).timestamp()
+        top = self.top(
+            f"{SENDER} and weekday = ? and hour = ? and started >= ?",
+            (sender, now.weekday(), now.hour, since),
+        )
+        if top and top[1] >= weekly_events_min_count:
+            return top[0]
+        top = self.top(
+            f"{SENDER} and {ANY_WEEKDAY} and hour = ? and started >= ?",
+            (sender, now.hour, since),
+        )
+        if top and top[1] >= daily_events_min_count:
+            return top[0]
+        return None
+
+    def visits(self, destination: Text, limit: int = 10) -> List[datetime]:
+        """ latest trips to destination """
+        rows = self.db.execute(
+            "select started from trip where destination = ? "
+            "order by started desc limit ?",
+            (normalize(destination), limit),
+        )
+        return [datetime.fromtimestamp(started) for (started,) in rows]
+
+    def save_place(self, name: Text, location: Text) -> None:
+        with self.db as db:
+            db.execute(
+                "insert or replace into place values (?, ?)", (normalize(name), location)
+            )
+
+    def place(self, name: Text) -> Optional[Text]:
+        """ location of a saved place e.g. "home" """
+        row = self.db.execute(
+            "select location from place where name = ?", (normalize(name),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def migrate(self, path: Text) -> None:
+        """ import the json database once """
+        db = self.db
+        # immediate so only one worker migrates
+        db.execute("begin immediate")
+        try:
+            done = db.execute("select 1 from meta where key = 'migrated'").fetchone()
+            if done or not os.path.exists(path):
+                db.rollback()
+                return
+            with open(path, encoding="utf-8") as f:
+                database = json.load(f)
+            trips = []
+            for address, started in database.get("destinations", []):
+                started = datetime.strptime(started, DATE_PATTERN)
+                trips.append(
+                    (
+                        normalize(address),
+                        started.timestamp(),
+                        started.weekday(),
+                        started.hour,
+                    )
+                )
+            db.executemany(
+                "insert into trip (destination, started, weekday, hour) "
+                "values (?, ?, ?, ?)",
+                trips,
+            )
+            places = [
+                (normalize(k), v)
+                for k, v in database.items()
+                if k != "destinations" and isinstance(v, str)
+            ]
+            db.executemany("insert or replace into place values (?, ?)", places)
+            db.execute("insert into meta values ('migrated', ?)", (path,))
+            db.commit()
+            log.info(f"migrated {len(trips)} trips and {len(places)} places from {path}")
+        except Exception:
+            db.rollback()
+            raise
@@ -0,0 +1,268 @@
+"""
+columnar trip log of (timestamp, speed limit, speed) samples
+
+    file layout
+        header      HEADER bytes. magic, version and rows per chunk
+        chunks      each chunk_dtype(rows) i.e. a small index then a column per field
+                        index       count, min and max of each column
+                        timestamp   float64 seconds since the epoch
+                        limit       float32 km/h
+                        speed       float32 km/h
+    every chunk is the same size so the file is a structured memmap of chunks and
+    each column of a chunk is a zero copy view. samples are appended in time order
+    to the last chunk until it is full then to a new one. the count is written after
+    the samples so a reader never sees a partial sample.
+
+    reads for a time range skip chunks using the index and trim the first and last
+    with searchsorted. only the pages read are loaded so months of telemetry stay
+    on disk.
+
+    import csv or json logs
+        python -m actions.triplog import trip.csv dbtest/triplog.bin
+    csv with a header with timestamp (or time, ts), limit (or speed_limit) and speed
+    (or actual_speed) columns. json as a list of objects with the same keys or an
+    object of column lists. timestamps are seconds or iso format.
+"""
+from typing import Iterable, Iterator, List, Optional, Sequence, Text, Tuple
+from datetime import datetime
+from itertools import islice
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from .speed import ZONES, SpeedReport, analyse_chunks
+
+import logging
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"TRIPLOGS"
+VERSION = 1
+HEADER = 64
+ROWS = 1 << 16
+# rows converted at a time when importing
+BATCH = 1 << 16
+TRIP_LOG = "dbtest/triplog.bin"
+
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("rows", "<u4")])
+INDEX_DTYPE = np.dtype(
+    [
+        ("count", "<u4"),
+        ("pad", "<u4"),
+        ("timestamp_min", "<f8"),
+        ("timestamp_max", "<f8"),
+        ("limit_min", "<f4"),
+        ("limit_max", "<f4"),
+        ("speed_min", "<f4"),
+        ("speed_max", "<f4"),
+    ]
+)
+COLUMNS = dict(timestamp="<f8", limit="<f4", speed="<f4")
+ALIASES = dict(
+    timestamp=["timestamp", "time", "ts"],
+    limit=["limit", "speed_limit", "speed_limits"],
+    speed=["speed", "actual_speed"],
+)
+
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def chunk_dtype(rows: int) -> np.dtype:
+    return np.dtype(
+        [("index", INDEX_DTYPE)] + [(k, v, (rows,)) for k, v in COLUMNS.items()]
+    )
+
+
+class TripLog:
+    def __init__(self, path: Text = TRIP_LOG, rows: int = ROWS):
+        """ open or create the log. rows per chunk is only used for a new file. """
+        self.path = path
+        if not os.path.exists(path) or not os.path.getsize(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            header = np.zeros(1, HEADER_DTYPE)
+            header[0] = (MAGIC, VERSION, rows)
+            with open(path, "wb") as f:
+                f.write(header.tobytes().ljust(HEADER, b"\0"))
+        with open(path, "rb") as f:
+            header = np.frombuffer(f.read(HEADER_DTYPE.itemsize), HEADER_DTYPE)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} trip log")
+        self.rows = int(header["rows"])
+        self.dtype = chunk_dtype(self.rows)
+
+    def chunks(self, mode: Text = "r") -> np.ndarray:
+        """ memmap of the chunks. empty if there are none. """
+        n = self.size()
+        if not n:
+            return np.zeros(0, self.dtype)
+        return np.memmap(self.path, self.dtype, mode, offset=HEADER, shape=(n,))
+
+    def __len__(self) -> int:
+        return int(self.chunks()["index"]["count"].sum())
+
+    def append(
+        self,
+        timestamps: Sequence[float],
+        limits: Sequence[float],
+        speeds: Sequence[float],
+    ) -> None:
+        """ add samples in time order after any already in the log """
+        columns = dict(
+            timestamp=np.asarray(timestamps, dtype=COLUMNS["timestamp"]),
+            limit=np.asarray(limits, dtype=COLUMNS["limit"]),
+            speed=np.asarray(speeds, dtype=COLUMNS["speed"]),
+        )
+        total = len(columns["timestamp"])
+        if not total:
+            return
+        if np.any(np.diff(columns["timestamp"]) < 0):
+            raise ValueError("trip log samples must be in time order")
+
+        chunks = self.chunks()
+        index = chunks["index"]
+        count = int(index["count"][-1]) if len(chunks) else self.rows
+        if len(chunks) and index["timestamp_max"][-1] > columns["timestamp"][0]:
+            raise ValueError("trip log samples must be after the last sample")
+        # whole empty chunks for the samples that do not fit in the last
+        space = self.rows - count
+        new = -(-(total - space) // self.rows) if total > space else 0
+        first = len(chunks) - (1 if space else 0)
+        del chunks, index
+        if new:
+            os.truncate(self.path, HEADER + (self.size() + new) * self.dtype.itemsize)
+
+        chunks = self.chunks("r+")
+        index = chunks["index"]
+        done = 0
+        for i in range(first, len(chunks)):
+            start = int(index["count"][i])
+            n = min(self.rows - start, total - done)
+            for name, values in columns.items():
+                part = values[done : done + n]
+                chunks[name][i, start : start + n] = part
+                low, high = part.min(), part.max()
+                if start:
+                    low = min(low, index[f"{name}_min"][i])
+                    high = max(high, index[f"{name}_max"][i])
+                index[f"{name}_min"][i] = low
+                index[f"{name}_max"][i] = high
+            chunks.flush()
+            # count last so readers only see complete samples
+            index["count"][i] = start + n
+            done += n
+        chunks.flush()
+        del chunks, index
+
+    def size(self) -> int:
+        """ number of chunks """
+        return (os.path.getsize(self.path) - HEADER) // self.dtype.itemsize
+
+    def read(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Iterator[Columns]:
+        """ (timestamps, limits, speeds) views of each chunk in start <= t < end """
+        chunks = self.chunks()
+        index = chunks["index"]
+        selected = index["count"] > 0
+        if start is not None:
+            selected &= index["timestamp_max"] >= start
+        if end is not None:
+            selected &= index["timestamp_min"] < end
+        for i in np.flatnonzero(selected):
+            count = int(index["count"][i])
+            timestamps = chunks["timestamp"][i, :count]
+            first, last = 0, count
+            if start is not None and index["timestamp_min"][i] < start:
+                first = int(np.searchsorted(timestamps, start, side="left"))
+            if end is not None and index["timestamp_max"][i] >= end:
+                last = int(np.searchsorted(timestamps, end, side="left"))
+            yield (
+                timestamps[first:last],
+                chunks["limit"][i, first:last],
+                chunks["speed"][i, first:last],
+            )
+
+    def analyse(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        zones=ZONES,
+    ) -> SpeedReport:
+        """ speed compliance for start <= t < end. see speed.py """
+        return analyse_chunks(
+            ((limits, speeds) for _, limits, speeds in self.read(start, end)), zones
+        )
+
+
+################################################################
+# import
+
+
+def timestamp(value) -> float:
+    """ seconds from a number or iso format """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def column_names(keys: Iterable[Text]) -> List[Text]:
+    """ names of the timestamp, limit and speed columns """
+    keys = list(keys)
+    lower = {k.strip().lower(): k for k in keys}
+    names = []
+    for column, aliases in ALIASES.items():
+        name = next((lower[a] for a in aliases if a in lower), None)
+        if name is None:
+            raise ValueError(f"no {column} column in {keys}")
+        names.append(name)
+    return names
+
+
+def read_csv(path: Text) -> Iterator[Tuple[List[float], ...]]:
+    """ batches of timestamps, limits, speeds """
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        names = column_names(reader.fieldnames or [])
+        while True:
+            rows = list(islice(reader, BATCH))
+            if not rows:
+                return
+            yield (
+                [timestamp(row[names[0]]) for row in rows],
+                [float(row[names[1]]) for row in rows],
+                [float(row[names[2]]) for row in rows],
+            )
+
+
+def read_json(path: Text) -> Iterator[Tuple[List[float], ...]]:
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        names = column_names(data)
+        columns = [data[name] for name in names]
+    else:
+        names = column_names(data[0]) if data else list(ALIASES)
+        columns = [[row[name] for row in data] for name in names]
+    for start in range(0, len(columns[0]), BATCH):
+        ts, limits, speeds = (c[start : start + BATCH] for c in columns)
+        yield [timestamp(t) for t in ts], limits, speeds
+
+
+def convert(source: Text, target: Text = TRIP_LOG) -> TripLog:
+    """ append a csv or json log to a trip log """
+    trip_log = TripLog(target)
+    batches = read_json(source) if source.lower().endswith(".json") else read_csv(source)
+    for timestamps, limits, speeds in batches:
+        trip_log.append(timestamps, limits, speeds)
+    log.info(f"{target} has {len(trip_log)} samples")
+    return trip_log
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "import":
+        sys.exit("usage: python -m actions.triplog import source.csv|json [target]")
+    convert(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else TRIP_LOG)
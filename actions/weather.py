@@ -3,84 +3,33 @@ from rasa_sdk import Action, Tracker
 from rasa_sdk.events import SlotSet
 from rasa_sdk.executor import CollectingDispatcher
 
-import os
-import requests as req
-from datetime import datetime
-from ctparse import ctparse
 import logging
 
-log = logging.getLogger(__name__)
-
-
-# OPEN WEATHER MAP --> https://openweathermap.org/api/one-call-api
-# create your own account, get your api key
-# subscribe: Current Weather Data and One Call API
-OPEN_WEATHER_MAP_API_KEY = os.environ["OPEN_WEATHER_MAP_API_KEY"]
-OPEN_WEATHER_MAP_API_ENDPOINT = "https://api.openweathermap.org/data/2.5/onecall"
-
-# https://positionstack.com/documentation
-# get the Geo-coordinates from city or place name
-POSITION_STACK_API_KEY = os.environ["POSITION_STACK_API_KEY"]
-POSITION_STACK_API_ENDPOINT = "http://api.positionstack.com/v1/forward"
-
-
-def api_connector(location, unit):
-    parameters_long_let = {
-        "access_key": POSITION_STACK_API_KEY,
-        "query": str(location),
-    }
-
-    res_long_let = req.get(url=POSITION_STACK_API_ENDPOINT, params=parameters_long_let)
-
-    lon = res_long_let.json()["data"][0]["longitude"]
-    lat = res_long_let.json()["data"][0]["latitude"]
+from .apis.client import APIError
+from .apis.weather import geocode, forecast
+from .times import resolve_time
 
-    parameters_owm = {
-        "lat": lat,
-        "lon": lon,
-        "exclude": "minutely,hourly",
-        "appid": OPEN_WEATHER_MAP_API_KEY,
-        "units": unit,
-    }
-
-    res_owm = req.get(url=OPEN_WEATHER_MAP_API_ENDPOINT, params=parameters_owm)
-    return res_owm
+log = logging.getLogger(__name__)
 
 
-def time_delta(time):
-    today = datetime.today()
+async def api_connector(location, unit):
+    """ return one call forecast for location or None if not available """
     try:
-        date = datetime.strptime(time[:10], "%Y-%m-%d")
-    except:
-        parser = ctparse(time, ts=today, latent_time=False)
-        date = datetime.strptime(str(parser.resolution).split(" ")[0], "%Y-%m-%d")
-    delta = (date.date() - today.date()).days
-    return delta
-
-
-def get_time_text(time, tracker):
-    """ return original text from time 
-    value from duckling is date string. may need original text such as "tomorrow"
-    """
-    try:
-        time_ent = [
-            e for e in tracker.latest_message["entities"] if e["entity"] == "time"
-        ][-1]
-        time = time_ent.get("text", "time")
-        # TODO can remove time from diet training and ctparse above if this warning does not heppen
-        if time_ent["extractor"] != "DucklingEntityExtractor":
-            log.warning("time was not extracted by duckling")
-    except IndexError:
-        pass
-
-    return time
+        position = await geocode(location)
+        if position is None:
+            log.warning(f"location not found {location}")
+            return None
+        return await forecast(*position, unit)
+    except APIError:
+        log.exception("weather api failed")
+        return None
 
 
 class Weather(Action):
     def name(self) -> Text:
         return "weather_handler"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -93,17 +42,19 @@ class Weather(Action):
         time = tracker.get_slot("time")
 
         # connect to APIs
-        response = api_connector(location, unit)
-        if response.status_code != 200:
+        response = await api_connector(location, unit)
+        if response is None:
             dispatcher.utter_message("Sorry, I can't connect to the weather API")
             return defaults
         # retrieve exact day difference from today's date
-        delta = time_delta(time)
-        time = get_time_text(time, tracker)
+        delta, time = resolve_time(time, tracker)
+        if delta is None:
+            dispatcher.utter_message(text=f"Sorry, I don't understand when {time} is")
+            return defaults
 
         # today
         if delta == 0:
-            temp = round(response.json()["current"]["temp"])
+            temp = round(response["current"]["temp"])
             dispatcher.utter_message(
                 text=f"current temperature in {location} is {temp} Celsius"
             )
@@ -112,7 +63,7 @@ class Weather(Action):
         # forecasting
         # only one-call api works for 7 days forecasting
         elif (delta > 0) and (delta <= 7):
-            temp = round(response.json()["daily"][delta]["temp"]["day"])
+            temp = round(response["daily"][delta]["temp"]["day"])
             dispatcher.utter_message(
                 text=f"The temperature in {location} {time} will be {temp} Celsius"
             )
@@ -127,7 +78,7 @@ class WeatherTemperature(Action):
     def name(self) -> Text:
         return "weather_handler_temperature"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -138,13 +89,18 @@ class WeatherTemperature(Action):
         time = tracker.get_slot("time")
         hotcold = tracker.get_slot("hotcold")
 
-        response = api_connector(location, unit)
+        response = await api_connector(location, unit)
+        if response is None:
+            dispatcher.utter_message("Sorry, I can't connect to the weather API")
+            return []
 
-        delta = time_delta(time)
-        time = get_time_text(time, tracker)
+        delta, time = resolve_time(time, tracker)
+        if delta is None:
+            dispatcher.utter_message(text=f"Sorry, I don't understand when {time} is")
+            return []
 
         if delta == 0:
-            temp = round(response.json()["current"]["temp"])
+            temp = round(response["current"]["temp"])
             # check cold or not
             if hotcold.lower() == "cold":
                 if temp <= 15:
@@ -183,7 +139,7 @@ class WeatherTemperature(Action):
 
         # only one-call api works for 7 days forecasting
         elif delta > 0:
-            temp = round(response.json()["daily"][delta]["temp"]["day"])
+            temp = round(response["daily"][delta]["temp"]["day"])
             # check cold or not
             if hotcold.lower() == "cold":
                 if temp <= 8:
@@ -0,0 +1,264 @@
+"""
+cache of nlu results for repeated utterances e.g. "navigate home", "stop navigation"
+
+    NLUCache goes directly after EnzoPreprocessor and looks up the normalized text
+    NLUCacheWriter goes at the end of the pipeline and saves the result
+    on a cache hit the components below are skipped. use them in config.yml in place
+    of the rasa component with the same name e.g. enzocache.DIETClassifier
+
+results with time relative entities e.g. "tomorrow" are not cached
+the cache is reset when a model with a different fingerprint is loaded
+"""
+import typing
+from typing import Any, Optional, Text, Dict, List
+from collections import OrderedDict
+from copy import deepcopy
+from time import monotonic
+import hashlib
+import logging
+import os
+
+from rasa.nlu.components import Component
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.constants import TEXT, ENTITIES, ENTITY_ATTRIBUTE_TYPE
+
+from rasa.nlu.featurizers.dense_featurizer.lm_featurizer import (
+    LanguageModelFeaturizer as _LanguageModelFeaturizer,
+)
+from rasa.nlu.featurizers.sparse_featurizer.regex_featurizer import (
+    RegexFeaturizer as _RegexFeaturizer,
+)
+from rasa.nlu.classifiers.diet_classifier import DIETClassifier as _DIETClassifier
+from rasa.nlu.utils.spacy_utils import SpacyNLP as _SpacyNLP
+from rasa.nlu.extractors.spacy_entity_extractor import (
+    SpacyEntityExtractor as _SpacyEntityExtractor,
+)
+from rasa.nlu.extractors.duckling_entity_extractor import (
+    DucklingEntityExtractor as _DucklingEntityExtractor,
+)
+from rasa.nlu.classifiers.fallback_classifier import (
+    FallbackClassifier as _FallbackClassifier,
+)
+from rasa.nlu.extractors.entity_synonyms import (
+    EntitySynonymMapper as _EntitySynonymMapper,
+)
+from rasa.nlu.selectors.response_selector import ResponseSelector as _ResponseSelector
+
+if typing.TYPE_CHECKING:
+    from rasa.nlu.model import Metadata
+
+log = logging.getLogger(__name__)
+
+# message attributes set by NLUCache. not added to the output.
+CACHE_HIT = "cache_hit"
+CACHE_KEY = "cache_key"
+
+
+class ResultCache:
+    """ bounded LRU with TTL and hit/miss counters """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Text) -> Optional[Dict[Text, Any]]:
+        item = self.items.get(key)
+        if item is not None:
+            expires, value = item
+            if expires > monotonic():
+                self.items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.items[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: Text, value: Dict[Text, Any]) -> None:
+        self.items[key] = (monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def stats(self) -> Dict[Text, Any]:
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self.items),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=round(self.hits / lookups, 3) if lookups else 0.0,
+        )
+
+
+# one cache per loaded model fingerprint, shared by NLUCache and NLUCacheWriter
+_caches: Dict[Text, ResultCache] = {}
+
+
+def get_cache(fingerprint: Text, max_size: int, ttl: float) -> ResultCache:
+    if fingerprint not in _caches:
+        # new model so previous results are invalid
+        _caches.clear()
+        _caches[fingerprint] = ResultCache(max_size, ttl)
+        log.info(f"nlu cache created for model {fingerprint}")
+    return _caches[fingerprint]
+
+
+def model_fingerprint(model_metadata: Optional["Metadata"]) -> Optional[Text]:
+    """ hash of fingerprint.json in the unpacked model else the training time """
+    if model_metadata is None:
+        return None
+    path = os.path.join(model_metadata.model_dir, os.pardir, "fingerprint.json")
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return str(model_metadata.get("trained_at"))
+
+
+class NLUCache(Component):
+    """ lookup normalized text and set the cached nlu result """
+
+    defaults = {
+        "max_size": 10000,
+        # seconds
+        "ttl": 3600,
+        # results with these entities depend on when they were said
+        "volatile_entities": ["time", "duration"],
+        # log hit/miss counters every n lookups
+        "report_every": 1000,
+    }
+
+    def __init__(
+        self,
+        component_config: Optional[Dict[Text, Any]] = None,
+        cache: Optional[ResultCache] = None,
+    ) -> None:
+        super().__init__(component_config)
+        self.cache = cache
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        txt = message.get(TEXT)
+        if self.cache is None or not txt:
+            return
+        result = self.cache.get(txt)
+        lookups = self.cache.hits + self.cache.misses
+        if lookups % self.component_config["report_every"] == 0:
+            log.info(f"nlu cache {self.cache.stats()}")
+        if result is None:
+            message.set(CACHE_KEY, txt)
+            return
+        for attribute, value in deepcopy(result).items():
+            message.set(attribute, value, add_to_output=True)
+        message.set(CACHE_HIT, True)
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Text,
+        model_metadata: Optional["Metadata"] = None,
+        cached_component: Optional["Component"] = None,
+        **kwargs: Any,
+    ) -> "Component":
+        fingerprint = model_fingerprint(model_metadata)
+        cache = None
+        if fingerprint:
+            cache = get_cache(fingerprint, meta["max_size"], meta["ttl"])
+        return cls(meta, cache)
+
+
+class NLUCacheWriter(Component):
+    """ save the nlu result for the message. goes at the end of the pipeline. """
+
+    defaults = {"volatile_entities": NLUCache.defaults["volatile_entities"]}
+
+    def __init__(
+        self,
+        component_config: Optional[Dict[Text, Any]] = None,
+        cache: Optional[ResultCache] = None,
+    ) -> None:
+        super().__init__(component_config)
+        self.cache = cache
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        key = message.get(CACHE_KEY)
+        if self.cache is None or key is None or message.get(CACHE_HIT):
+            return
+        volatile = self.component_config["volatile_entities"]
+        if any(
+            e.get(ENTITY_ATTRIBUTE_TYPE) in volatile
+            for e in message.get(ENTITIES) or []
+        ):
+            return
+        result = {
+            attribute: message.get(attribute)
+            for attribute in message.output_properties
+            if attribute != TEXT
+        }
+        self.cache.set(key, deepcopy(result))
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Text,
+        model_metadata: Optional["Metadata"] = None,
+        cached_component: Optional["Component"] = None,
+        **kwargs: Any,
+    ) -> "Component":
+        fingerprint = model_fingerprint(model_metadata)
+        cache = None
+        if fingerprint:
+            defaults = NLUCache.defaults
+            cache = get_cache(fingerprint, defaults["max_size"], defaults["ttl"])
+        return cls(meta, cache)
+
+
+class SkipOnCacheHit:
+    """ mixin for components that do not need to run when the result is cached """
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        if message.get(CACHE_HIT):
+            return
+        super().process(message, **kwargs)
+
+
+# same class names as rasa so feature origins and entity extractor names are unchanged
+
+
+class LanguageModelFeaturizer(SkipOnCacheHit, _LanguageModelFeaturizer):
+    pass
+
+
+class RegexFeaturizer(SkipOnCacheHit, _RegexFeaturizer):
+    pass
+
+
+class DIETClassifier(SkipOnCacheHit, _DIETClassifier):
+    pass
+
+
+class SpacyNLP(SkipOnCacheHit, _SpacyNLP):
+    pass
+
+
+class SpacyEntityExtractor(SkipOnCacheHit, _SpacyEntityExtractor):
+    pass
+
+
+class DucklingEntityExtractor(SkipOnCacheHit, _DucklingEntityExtractor):
+    pass
+
+
+class FallbackClassifier(SkipOnCacheHit, _FallbackClassifier):
+    pass
+
+
+class EntitySynonymMapper(SkipOnCacheHit, _EntitySynonymMapper):
+    pass
+
+
+class ResponseSelector(SkipOnCacheHit, _ResponseSelector):
+    pass
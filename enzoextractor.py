@@ -0,0 +1,437 @@
+"""
+in-process replacement for DucklingEntityExtractor. no http call to a duckling server.
+
+    dimensions: distance, duration, number, ordinal, phone-number, time, temperature
+    output is in duckling format including additional_info.value
+    time uses ctparse. parses are memoized by (text, reference date).
+    ctparse is imported on first use. if it is not installed time is skipped.
+    other dimensions use precompiled regex.
+"""
+import typing
+from typing import Any, Optional, Text, Dict, List, Tuple
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+import logging
+import re
+import time
+
+import pytz
+
+from rasa.nlu.extractors.extractor import EntityExtractor
+from rasa.nlu.extractors.duckling_entity_extractor import (
+    convert_duckling_format_to_rasa,
+    DucklingEntityExtractor,
+)
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.constants import TEXT, ENTITIES
+
+from enzocache import CACHE_HIT
+
+if typing.TYPE_CHECKING:
+    from ctparse.types import Time
+    from rasa.nlu.model import Metadata
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+for x in ["ctparse", "partial_parse"]:
+    logging.getLogger(x).setLevel(logging.ERROR)
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60,
+    "seventy": 70, "eighty": 80, "ninety": 90,
+}
+SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6,
+    "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11,
+    "twelfth": 12, "thirteenth": 13, "fourteenth": 14, "fifteenth": 15,
+    "sixteenth": 16, "seventeenth": 17, "eighteenth": 18, "nineteenth": 19,
+    "twentieth": 20, "thirtieth": 30, "fortieth": 40, "fiftieth": 50,
+}
+DISTANCE_UNITS = {
+    "km": "kilometre", "kms": "kilometre", "kilometer": "kilometre",
+    "kilometers": "kilometre", "kilometre": "kilometre", "kilometres": "kilometre",
+    "mi": "mile", "mile": "mile", "miles": "mile",
+    "m": "metre", "meter": "metre", "meters": "metre", "metre": "metre",
+    "metres": "metre", "yard": "yard", "yards": "yard", "ft": "foot",
+    "foot": "foot", "feet": "foot",
+}
+DURATION_SECONDS = {
+    "second": 1, "minute": 60, "hour": 3600, "day": 86400, "week": 604800,
+    "month": 2592000, "year": 31536000,
+}
+TEMPERATURE_UNITS = {
+    "c": "celsius", "celsius": "celsius", "centigrade": "celsius",
+    "f": "fahrenheit", "fahrenheit": "fahrenheit",
+}
+
+
+def _words(words):
+    return "|".join(sorted(words, key=len, reverse=True))
+
+
+NUMBER_WORD = _words(list(UNITS) + list(TENS) + list(SCALES))
+NUMBER = (
+    rf"(?:\d+(?:[.,]\d+)*|(?:{NUMBER_WORD})(?:(?:[\s-]+(?:and[\s-]+)?)(?:{NUMBER_WORD}))*)"
+)
+PATTERNS = {
+    "number": re.compile(rf"\b{NUMBER}\b", re.I),
+    "ordinal": re.compile(
+        rf"\b(?:(?:(?P<tens>{_words(TENS)})[\s-]+)?(?P<word>{_words(ORDINALS)})"
+        rf"|(?P<digits>\d+)(?:st|nd|rd|th))\b"
+        # "second one" is one choice not ordinal plus number
+        r"(?:\s+ones?\b)?",
+        re.I,
+    ),
+    # "5km" but not "am" or "afoot"
+    "distance": re.compile(
+        rf"\b(?:(?P<value>{NUMBER})\s*|(?P<article>an?)\s+)"
+        rf"(?P<unit>{_words(DISTANCE_UNITS)})\b",
+        re.I,
+    ),
+    "duration": re.compile(
+        rf"\b(?:(?P<value>{NUMBER})\s*|(?P<article>an?)\s+)"
+        rf"(?P<unit>{_words(DURATION_SECONDS)})s?\b",
+        re.I,
+    ),
+    "temperature": re.compile(
+        rf"(?P<value>-?\b{NUMBER})\s*(?:°|degrees?\b)"
+        rf"(?:\s*(?P<unit>{_words(TEMPERATURE_UNITS)})\b)?",
+        re.I,
+    ),
+    "phone-number": re.compile(r"(?<![\w+])\+?\d[\d\- ()]{5,}\d\b"),
+}
+# ctparse is only called when one of these is in the text
+TIME_TRIGGER = re.compile(
+    r"\d|\b(?:today|tonight|tomorrow|yesterday|now|morning|afternoon|evening|night|"
+    r"noon|midnight|week|weekend|month|year|day|next|last|ago|am|pm|"
+    r"mon|tue|wed|thu|fri|sat|sun|jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)",
+    re.I,
+)
+
+
+@lru_cache(None)
+def get_ctparse():
+    """ (ctparse, Time, Interval) or None if ctparse is not installed """
+    try:
+        from ctparse import ctparse
+        from ctparse.types import Time, Interval
+    except ImportError:
+        log.warning("ctparse is not installed so time will not be extracted")
+        return None
+    return ctparse, Time, Interval
+
+
+def parse_number(text: Text) -> Optional[float]:
+    """ "21" => 21, "1,000" => 1000, "twenty one" => 21, "a" => 1 """
+    text = text.lower().strip()
+    if text in ("a", "an"):
+        return 1
+    if text[0].isdigit():
+        text = text.replace(",", "")
+        value = float(text)
+        return int(value) if value.is_integer() else value
+    total, current = 0, 0
+    for word in re.split(r"[\s-]+", text):
+        if word == "and":
+            continue
+        if word in UNITS:
+            current += UNITS[word]
+        elif word in TENS:
+            current += TENS[word]
+        elif word == "hundred":
+            current = max(current, 1) * 100
+        elif word in SCALES:
+            total += max(current, 1) * SCALES[word]
+            current = 0
+    return total + current
+
+
+def _match(dim: Text, match: "re.Match", value: Dict[Text, Any]) -> Dict[Text, Any]:
+    return dict(
+        dim=dim, body=match.group(0), start=match.start(), end=match.end(), value=value
+    )
+
+
+def extract_numbers(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["number"].finditer(text):
+        value = parse_number(m.group(0))
+        matches.append(_match("number", m, dict(value=value, type="value")))
+    return matches
+
+
+def extract_ordinals(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["ordinal"].finditer(text):
+        if m.group("digits"):
+            value = int(m.group("digits"))
+        else:
+            value = ORDINALS[m.group("word").lower()]
+            if m.group("tens"):
+                value += TENS[m.group("tens").lower()]
+        matches.append(_match("ordinal", m, dict(value=value, type="value")))
+    return matches
+
+
+def extract_distances(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["distance"].finditer(text):
+        value = parse_number(m.group("value") or m.group("article"))
+        unit = DISTANCE_UNITS[m.group("unit").lower()]
+        matches.append(_match("distance", m, dict(value=value, type="value", unit=unit)))
+    return matches
+
+
+def extract_durations(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["duration"].finditer(text):
+        value = parse_number(m.group("value") or m.group("article"))
+        unit = m.group("unit").lower()
+        info = {
+            "value": value,
+            unit: value,
+            "type": "value",
+            "unit": unit,
+            "normalized": dict(value=value * DURATION_SECONDS[unit], unit="second"),
+        }
+        matches.append(_match("duration", m, info))
+    return matches
+
+
+def extract_temperatures(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["temperature"].finditer(text):
+        value = parse_number(m.group("value").lstrip("-"))
+        if m.group("value").startswith("-"):
+            value = -value
+        unit = TEMPERATURE_UNITS.get((m.group("unit") or "").lower(), "degree")
+        matches.append(
+            _match("temperature", m, dict(value=value, type="value", unit=unit))
+        )
+    return matches
+
+
+def extract_phone_numbers(text: Text) -> List[Dict[Text, Any]]:
+    matches = []
+    for m in PATTERNS["phone-number"].finditer(text):
+        value = re.sub(r"[^\d+]", "", m.group(0))
+        if len(value.lstrip("+")) < 7:
+            continue
+        matches.append(_match("phone-number", m, dict(value=value)))
+    return matches
+
+
+class TimeParser:
+    """ ctparse with memoized results
+
+    results for days e.g. "tomorrow" are keyed by (text, reference date)
+    results with a time of day e.g. "in 2 hours" are keyed by (text, reference minute)
+    """
+
+    def __init__(
+        self, timezone: Text = "UTC", timeout: float = 0.5, max_size: int = 10000
+    ) -> None:
+        self.timezone = pytz.timezone(timezone)
+        self.timeout = timeout
+        self.max_size = max_size
+        self.memo = OrderedDict()
+
+    def _get(self, key: Tuple) -> Any:
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            return self.memo[key]
+        return _MISSING
+
+    def _set(self, key: Tuple, value: Any) -> None:
+        self.memo[key] = value
+        while len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+
+    def parse(self, text: Text, reference: datetime) -> List[Dict[Text, Any]]:
+        if not TIME_TRIGGER.search(text) or get_ctparse() is None:
+            return []
+        day_key = (text, reference.date())
+        minute_key = (text, reference.replace(second=0, microsecond=0))
+        for key in (day_key, minute_key):
+            result = self._get(key)
+            if result is not _MISSING:
+                return result
+
+        result, day_grain = self._parse(text, reference)
+        self._set(day_key if day_grain else minute_key, result)
+        return result
+
+    def _parse(self, text: Text, reference: datetime) -> Tuple[List[Dict], bool]:
+        ctparse, Time, Interval = get_ctparse()
+        try:
+            parsed = ctparse(
+                text, ts=reference.replace(tzinfo=None), timeout=self.timeout,
+                latent_time=True,
+            )
+        except Exception:
+            log.exception(f"ctparse failed for {text}")
+            return [], True
+        if parsed is None:
+            return [], True
+
+        resolution = parsed.resolution
+        if isinstance(resolution, Time):
+            value = self._value(resolution)
+            if value is None:
+                return [], True
+            info = dict(values=[value], **value)
+            day_grain = value["grain"] == "day"
+        elif isinstance(resolution, Interval):
+            start = self._value(resolution.t_from) if resolution.t_from else None
+            end = self._value(resolution.t_to) if resolution.t_to else None
+            if start is None and end is None:
+                return [], True
+            info = {"type": "interval"}
+            if start:
+                info["from"] = dict(value=start["value"], grain=start["grain"])
+            if end:
+                info["to"] = dict(value=end["value"], grain=end["grain"])
+            info["values"] = [dict(info)]
+            day_grain = all(x is None or x["grain"] == "day" for x in (start, end))
+        else:
+            return [], True
+
+        match = dict(
+            dim="time",
+            body=text[resolution.mstart : resolution.mend],
+            start=resolution.mstart,
+            end=resolution.mend,
+            value=info,
+        )
+        return [match], day_grain
+
+    def _value(self, t: "Time") -> Optional[Dict[Text, Any]]:
+        if t.year is None or t.month is None or t.day is None:
+            return None
+        if t.hour is None:
+            grain = "day"
+        elif t.minute is None:
+            grain = "hour"
+        else:
+            grain = "minute"
+        dt = self.timezone.localize(
+            datetime(t.year, t.month, t.day, t.hour or 0, t.minute or 0)
+        )
+        offset = dt.strftime("%z")
+        value = dt.strftime("%Y-%m-%dT%H:%M:%S.000") + f"{offset[:3]}:{offset[3:]}"
+        return dict(value=value, grain=grain, type="value")
+
+
+EXTRACTORS = {
+    "number": extract_numbers,
+    "ordinal": extract_ordinals,
+    "distance": extract_distances,
+    "duration": extract_durations,
+    "temperature": extract_temperatures,
+    "phone-number": extract_phone_numbers,
+}
+
+
+def remove_contained(matches: List[Dict[Text, Any]]) -> List[Dict[Text, Any]]:
+    """ remove matches inside a longer match e.g. number "5" inside distance "5 km" """
+    out = []
+    for m in sorted(matches, key=lambda x: (x["start"], x["end"])):
+        inside = any(
+            o is not m
+            and o["start"] <= m["start"]
+            and m["end"] <= o["end"]
+            and (o["end"] - o["start"]) > (m["end"] - m["start"])
+            for o in matches
+        )
+        if not inside:
+            out.append(m)
+    return out
+
+
+class EnzoEntityExtractor(EntityExtractor):
+    """ extract duckling dimensions in process. skipped on a cache hit. """
+
+    defaults = {
+        # by default all dimensions recognized are returned
+        "dimensions": None,
+        "timezone": "UTC",
+        # seconds allowed for ctparse
+        "timeout": 0.5,
+        # memoized time parses
+        "max_size": 10000,
+    }
+
+    def __init__(self, component_config: Optional[Dict[Text, Any]] = None) -> None:
+        super().__init__(component_config)
+        self.time_parser = TimeParser(
+            self.component_config["timezone"],
+            self.component_config["timeout"],
+            self.component_config["max_size"],
+        )
+
+    def _reference_time(self, message: Message) -> datetime:
+        ts = message.time
+        if ts is None:
+            ts = time.time()
+        else:
+            # duckling convention is milliseconds
+            ts = int(ts)
+            if ts > 1e11:
+                ts = ts / 1000
+        return datetime.fromtimestamp(ts, self.time_parser.timezone)
+
+    def dimensions(self, message: Message) -> List[Text]:
+        """ dimensions to extract for the message """
+        return self.component_config["dimensions"] or list(EXTRACTORS) + ["time"]
+
+    def extract(
+        self, text: Text, reference: datetime, dimensions: List[Text]
+    ) -> List[Dict[Text, Any]]:
+        """ return duckling style matches """
+        matches = []
+        for dim in dimensions:
+            if dim == "time":
+                matches.extend(self.time_parser.parse(text, reference))
+            elif dim in EXTRACTORS:
+                matches.extend(EXTRACTORS[dim](text))
+        return remove_contained(matches)
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        # entities are already in the cached result
+        if message.get(CACHE_HIT):
+            return
+        text = message.get(TEXT)
+        if not text:
+            return
+        matches = self.extract(
+            text, self._reference_time(message), self.dimensions(message)
+        )
+        extracted = convert_duckling_format_to_rasa(matches)
+        extracted = DucklingEntityExtractor.filter_irrelevant_entities(
+            extracted, self.component_config["dimensions"]
+        )
+        extracted = self.add_extractor_name(extracted)
+        message.set(ENTITIES, message.get(ENTITIES, []) + extracted, add_to_output=True)
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Text,
+        model_metadata: Optional["Metadata"] = None,
+        cached_component: Optional["Component"] = None,
+        **kwargs: Any,
+    ) -> "EnzoEntityExtractor":
+        if cached_component:
+            return cached_component
+        return cls(meta)
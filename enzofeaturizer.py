@@ -0,0 +1,300 @@
+"""
+LanguageModelFeaturizer with a persistent cache of features for training
+and an optional int8 quantized model for cpu inference
+
+    features are keyed by hash of (model weights, attribute, text, tokens)
+    stored on disk as float32 rows in one append-only file read via memory map
+    retraining only computes features for new or edited examples
+
+    layout in feature_cache_dir/<model hash>/
+        features.f32    sequence rows followed by the sentence row for each example
+        index.json      key => [first row, number of sequence rows]
+
+    quantize: True converts the transformer to tflite with dynamic range quantization
+    features differ slightly from the float model so DIET must be retrained with it.
+    the tflite model is saved in the rasa model. sequences are padded to length
+    buckets so interpreters are reused. training batches are sorted by length.
+"""
+import typing
+from typing import Any, Optional, Text, Dict, List, Tuple
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from rasa.nlu.config import RasaNLUModelConfig
+from rasa.nlu.constants import (
+    DENSE_FEATURIZABLE_ATTRIBUTES,
+    TOKENS_NAMES,
+    SEQUENCE_FEATURES,
+    SENTENCE_FEATURES,
+)
+from rasa.shared.nlu.training_data.training_data import TrainingData
+from rasa.shared.nlu.training_data.message import Message
+
+from enzocache import LanguageModelFeaturizer as _LanguageModelFeaturizer
+
+if typing.TYPE_CHECKING:
+    from rasa.nlu.components import Component
+    from rasa.nlu.model import Metadata
+
+log = logging.getLogger(__name__)
+
+
+class FeatureStore:
+    """ append-only memory-mapped store of feature arrays """
+
+    def __init__(self, path: Text) -> None:
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        self.data_path = os.path.join(path, "features.f32")
+        os.makedirs(path, exist_ok=True)
+
+        self.dim = None
+        self.rows = 0
+        self.index: Dict[Text, List[int]] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                saved = json.load(f)
+            self.dim, self.rows, self.index = saved["dim"], saved["rows"], saved["index"]
+        self.pending: Dict[Text, Dict[Text, np.ndarray]] = {}
+        self.data = None
+        self._map()
+        self.hits = 0
+        self.misses = 0
+
+    def _map(self) -> None:
+        if self.rows:
+            self.data = np.memmap(
+                self.data_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim)
+            )
+
+    def get(self, key: Text) -> Optional[Dict[Text, np.ndarray]]:
+        if key in self.pending:
+            self.hits += 1
+            return self.pending[key]
+        item = self.index.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        start, length = item
+        rows = self.data[start : start + length + 1]
+        return {
+            SEQUENCE_FEATURES: np.array(rows[:length]),
+            SENTENCE_FEATURES: np.array(rows[length:]),
+        }
+
+    def add(self, key: Text, doc: Dict[Text, np.ndarray]) -> None:
+        self.pending[key] = doc
+
+    def flush(self) -> None:
+        """ append pending features to disk and save the index """
+        if not self.pending:
+            return
+        with open(self.data_path, "ab") as f:
+            # drop anything written after the last saved index e.g. a crash
+            f.truncate(self.rows * (self.dim or 0) * 4)
+            for key, doc in self.pending.items():
+                sequence = np.asarray(doc[SEQUENCE_FEATURES], dtype=np.float32)
+                sentence = np.asarray(doc[SENTENCE_FEATURES], dtype=np.float32)
+                self.dim = sequence.shape[-1]
+                f.write(sequence.tobytes())
+                f.write(sentence.reshape(1, -1).tobytes())
+                self.index[key] = [self.rows, len(sequence)]
+                self.rows += len(sequence) + 1
+        temp = f"{self.index_path}.tmp"
+        with open(temp, "w") as f:
+            json.dump(dict(dim=self.dim, rows=self.rows, index=self.index), f)
+        os.replace(temp, self.index_path)
+        self.pending = {}
+        self._map()
+
+
+class LanguageModelFeaturizer(_LanguageModelFeaturizer):
+    """ caches features on disk during training. optional int8 model for cpu. """
+
+    defaults = {
+        **_LanguageModelFeaturizer.defaults,
+        # None to disable the cache
+        "feature_cache_dir": ".featurecache",
+        # int8 dynamic range quantized tflite model used for train and process
+        "quantize": False,
+        # sequences are padded to the next bucket so tflite shapes are reused
+        "buckets": [8, 16, 32, 64, 128, 256, 512],
+        "batch_size": 64,
+    }
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.store: Optional[FeatureStore] = None
+        self.quantized_model: Optional[bytes] = None
+        self.interpreters: Dict[Tuple[int, int], Any] = {}
+
+    def _model_hash(self) -> Text:
+        """ hash of the model weights so a different model never reuses features """
+        h = hashlib.sha1(f"{self.model_name}:{self.model_weights}".encode())
+        if self.component_config["quantize"]:
+            h.update(b"quantized")
+        for weights in self.model.weights:
+            h.update(np.asarray(weights).tobytes())
+        return h.hexdigest()
+
+    def _get_store(self) -> Optional[FeatureStore]:
+        cache_dir = self.component_config["feature_cache_dir"]
+        if self.store is None and cache_dir:
+            self.store = FeatureStore(os.path.join(cache_dir, self._model_hash()))
+        return self.store
+
+    @staticmethod
+    def _key(message: Message, attribute: Text) -> Text:
+        tokens = " ".join(t.text for t in message.get(TOKENS_NAMES[attribute]))
+        text = f"{attribute}\0{message.get(attribute)}\0{tokens}"
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _get_docs_for_batch(
+        self,
+        batch_examples: List[Message],
+        attribute: Text,
+        inference_mode: bool = False,
+    ) -> List[Dict[Text, Any]]:
+        # parsed messages are cached by enzocache.NLUCache
+        store = None if inference_mode else self._get_store()
+        if store is None:
+            return super()._get_docs_for_batch(batch_examples, attribute, inference_mode)
+
+        keys = [self._key(example, attribute) for example in batch_examples]
+        docs = [store.get(key) for key in keys]
+        missing = [i for i, doc in enumerate(docs) if doc is None]
+        if missing:
+            computed = super()._get_docs_for_batch(
+                [batch_examples[i] for i in missing], attribute, inference_mode
+            )
+            for i, doc in zip(missing, computed):
+                store.add(keys[i], doc)
+                docs[i] = doc
+        return docs
+
+    def _quantize(self) -> bytes:
+        """ convert the transformer to tflite with int8 dynamic range quantization """
+        import tensorflow as tf
+
+        @tf.function(
+            input_signature=[
+                tf.TensorSpec([None, None], tf.int32, name="input_ids"),
+                tf.TensorSpec([None, None], tf.int32, name="attention_mask"),
+            ]
+        )
+        def serve(input_ids, attention_mask):
+            return self.model(input_ids, attention_mask=attention_mask)[0]
+
+        log.info(f"quantizing {self.model_weights}")
+        converter = tf.lite.TFLiteConverter.from_concrete_functions(
+            [serve.get_concrete_function()]
+        )
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS,
+        ]
+        return converter.convert()
+
+    def _get_interpreter(self, shape: Tuple[int, int]) -> Any:
+        """ one interpreter per (batch, bucket) so tensors are allocated once """
+        interpreter = self.interpreters.get(shape)
+        if interpreter is None:
+            import tensorflow as tf
+
+            if self.quantized_model is None:
+                self.quantized_model = self._quantize()
+            interpreter = tf.lite.Interpreter(model_content=self.quantized_model)
+            for detail in interpreter.get_input_details():
+                interpreter.resize_tensor_input(detail["index"], shape)
+            interpreter.allocate_tensors()
+            self.interpreters[shape] = interpreter
+        return interpreter
+
+    def _bucket(self, length: int) -> int:
+        for bucket in self.component_config["buckets"]:
+            if length <= bucket:
+                return bucket
+        return length
+
+    def _compute_batch_sequence_features(
+        self, batch_attention_mask: np.ndarray, padded_token_ids: List[List[int]]
+    ) -> np.ndarray:
+        if not self.component_config["quantize"]:
+            return super()._compute_batch_sequence_features(
+                batch_attention_mask, padded_token_ids
+            )
+        token_ids = np.array(padded_token_ids, dtype=np.int32)
+        mask = np.array(batch_attention_mask, dtype=np.int32)
+        batch, length = token_ids.shape
+        bucket = self._bucket(length)
+        if bucket > length:
+            pad = ((0, 0), (0, bucket - length))
+            token_ids = np.pad(token_ids, pad, constant_values=self.pad_token_id)
+            mask = np.pad(mask, pad, constant_values=0)
+
+        interpreter = self._get_interpreter((batch, bucket))
+        for detail in interpreter.get_input_details():
+            if "attention_mask" in detail["name"]:
+                interpreter.set_tensor(detail["index"], mask)
+            else:
+                interpreter.set_tensor(detail["index"], token_ids)
+        interpreter.invoke()
+        output = interpreter.get_output_details()[0]["index"]
+        return interpreter.get_tensor(output)[:, :length]
+
+    def train(
+        self,
+        training_data: TrainingData,
+        config: Optional[RasaNLUModelConfig] = None,
+        **kwargs: Any,
+    ) -> None:
+        """ same as rasa but batches are sorted by length to minimise padding """
+        if self.component_config["quantize"] and self.quantized_model is None:
+            self.quantized_model = self._quantize()
+        batch_size = self.component_config["batch_size"]
+        for attribute in DENSE_FEATURIZABLE_ATTRIBUTES:
+            examples = [x for x in training_data.training_examples if x.get(attribute)]
+            examples.sort(key=lambda x: len(x.get(TOKENS_NAMES[attribute]) or []))
+            for start in range(0, len(examples), batch_size):
+                batch = examples[start : start + batch_size]
+                docs = self._get_docs_for_batch(batch, attribute)
+                for doc, example in zip(docs, batch):
+                    self._set_lm_features(doc, example, attribute)
+
+        if self.store is not None:
+            self.store.flush()
+            log.info(
+                f"feature cache hits={self.store.hits} misses={self.store.misses} "
+                f"path={self.store.path}"
+            )
+
+    def persist(self, file_name: Text, model_dir: Text) -> Optional[Dict[Text, Any]]:
+        if self.quantized_model is None:
+            return None
+        tflite_file = f"{file_name}.tflite"
+        with open(os.path.join(model_dir, tflite_file), "wb") as f:
+            f.write(self.quantized_model)
+        return {"tflite_file": tflite_file}
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Text,
+        model_metadata: Optional["Metadata"] = None,
+        cached_component: Optional["Component"] = None,
+        **kwargs: Any,
+    ) -> "Component":
+        if cached_component:
+            return cached_component
+        component = cls(meta)
+        if meta.get("tflite_file"):
+            with open(os.path.join(model_dir, meta["tflite_file"]), "rb") as f:
+                component.quantized_model = f.read()
+        return component
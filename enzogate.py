@@ -0,0 +1,101 @@
+"""
+run expensive components only for the intents that need them
+
+    e.g. spacy is only needed to extract PERSON for call_make and message_send
+    components placed after DIETClassifier read the predicted intent and ranking.
+    use them in config.yml in place of the enzocache component with the same name.
+
+    config for each gated component
+        intents: run when the predicted intent is one of these. null to always run.
+        min_confidence: also run when any of the intents has at least this
+            confidence in the intent ranking
+
+    rasa 2.8 does not pass the tracker to the nlu pipeline so the active form is not
+    available here. form replies such as a bare name usually rank the form intent
+    highly, which min_confidence covers.
+
+    skipped components are listed in the parse data as "skipped_components"
+"""
+from typing import Any, Optional, Text, Dict, List
+import logging
+
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.constants import (
+    INTENT,
+    INTENT_NAME_KEY,
+    INTENT_RANKING_KEY,
+    PREDICTED_CONFIDENCE_KEY,
+)
+
+import enzocache
+import enzoextractor
+
+log = logging.getLogger(__name__)
+
+SKIPPED = "skipped_components"
+
+
+def add_skipped(message: Message, name: Text) -> None:
+    skipped = message.get(SKIPPED) or []
+    message.set(SKIPPED, skipped + [name], add_to_output=True)
+
+
+def intent_needed(
+    message: Message, intents: Optional[List[Text]], min_confidence: float
+) -> bool:
+    """ true if the predicted intent or a highly ranked intent is in intents """
+    if intents is None:
+        return True
+    intent = message.get(INTENT) or {}
+    if intent.get(INTENT_NAME_KEY) in intents:
+        return True
+    return any(
+        ranked.get(INTENT_NAME_KEY) in intents
+        and ranked.get(PREDICTED_CONFIDENCE_KEY, 0) >= min_confidence
+        for ranked in message.get(INTENT_RANKING_KEY) or []
+    )
+
+
+class IntentGate:
+    """ mixin that skips process unless the intent needs the component """
+
+    gate_defaults = {"intents": None, "min_confidence": 0.1}
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        # skipped_components is already in the cached result
+        if message.get(enzocache.CACHE_HIT):
+            return
+        config = {**self.gate_defaults, **self.component_config}
+        if not intent_needed(message, config["intents"], config["min_confidence"]):
+            add_skipped(message, self.name)
+            return
+        super().process(message, **kwargs)
+
+
+class SpacyNLP(IntentGate, enzocache.SpacyNLP):
+    pass
+
+
+class SpacyEntityExtractor(IntentGate, enzocache.SpacyEntityExtractor):
+    pass
+
+
+class EnzoEntityExtractor(enzoextractor.EnzoEntityExtractor):
+    """ always runs as numbers and ordinals are cheap. time is gated by time_intents. """
+
+    defaults = {
+        **enzoextractor.EnzoEntityExtractor.defaults,
+        "time_intents": None,
+        "min_confidence": IntentGate.gate_defaults["min_confidence"],
+    }
+
+    def dimensions(self, message: Message) -> List[Text]:
+        dimensions = super().dimensions(message)
+        if "time" in dimensions and not intent_needed(
+            message,
+            self.component_config["time_intents"],
+            self.component_config["min_confidence"],
+        ):
+            add_skipped(message, f"{self.name}.time")
+            dimensions = [d for d in dimensions if d != "time"]
+        return dimensions
@@ -1,30 +1,131 @@
 import typing
-from typing import Any, Optional, Text, Dict, List, Type
+from typing import Any, Optional, Text, Dict, List, Tuple, Type
 import re
+import logging
+from time import perf_counter
 
 from rasa.nlu.components import Component
 from rasa.nlu.config import RasaNLUModelConfig
 from rasa.shared.nlu.training_data.training_data import TrainingData
 from rasa.shared.nlu.training_data.message import Message
-from rasa.shared.nlu.constants import TEXT
+from rasa.shared.nlu.constants import TEXT, ENTITIES
 
 if typing.TYPE_CHECKING:
     from rasa.nlu.model import Metadata
 
+log = logging.getLogger(__name__)
+
 
 class EnzoPreprocessor(Component):
+    """ normalise text before tokenizing. same rules applied in train and process.
+
+    rules are compiled once into a single pattern so each string is one pass:
+        punctuation chars => space
+        runs of punctuation/whitespace => single space
+    """
+
+    defaults = {
+        # chars replaced by a space
+        "punctuation": ",;.",
+        # log a timing summary every n messages processed
+        "report_every": 1000,
+    }
+
+    def __init__(self, component_config: Optional[Dict[Text, Any]] = None) -> None:
+        super().__init__(component_config)
+        chars = re.escape(self.component_config["punctuation"])
+        # equivalent to re.sub(r"[,;.]", " ") followed by re.sub(r"\s\s+", " ")
+        self.pattern = re.compile(rf"[{chars}\s]{{2,}}|[{chars}]")
+        self.count = 0
+        self.elapsed = 0.0
+
+    def normalize(self, text: Text) -> Text:
+        return self.pattern.sub(" ", text)
+
+    def normalize_with_offsets(self, text: Text) -> Tuple[Text, List[int]]:
+        """ return normalized text and map of old char offset => new char offset
+
+        offsets has len(text) + 1 entries so entity end positions map too
+        """
+        out = []
+        offsets = []
+        pos = 0
+        new = 0
+        for match in self.pattern.finditer(text):
+            start, end = match.span()
+            offsets.extend(range(new, new + start - pos))
+            out.append(text[pos:start])
+            new += start - pos
+            # every char in the replaced run maps to the single space
+            offsets.extend([new] * (end - start))
+            out.append(" ")
+            new += 1
+            pos = end
+        offsets.extend(range(new, new + len(text) - pos + 1))
+        out.append(text[pos:])
+        return "".join(out), offsets
+
+    def normalize_message(self, message: Message) -> None:
+        """ normalize text and realign any entity annotations """
+        txt = message.get(TEXT)
+        if not txt:
+            return
+        entities = message.get(ENTITIES)
+        if not entities:
+            message.set(TEXT, self.normalize(txt))
+            return
+
+        out, offsets = self.normalize_with_offsets(txt)
+        for entity in entities:
+            surface = txt[entity["start"] : entity["end"]]
+            start, end = offsets[entity["start"]], offsets[entity["end"]]
+            # do not include spaces created from removed punctuation
+            while start < end and out[start] == " ":
+                start += 1
+            while end > start and out[end - 1] == " ":
+                end -= 1
+            entity["start"], entity["end"] = start, end
+            if entity.get("value") == surface:
+                entity["value"] = out[start:end]
+        message.set(TEXT, out)
+
+    def train(
+        self,
+        training_data: TrainingData,
+        config: Optional[RasaNLUModelConfig] = None,
+        **kwargs: Any,
+    ) -> None:
+        """ normalize all training examples so training matches inference """
+        start = perf_counter()
+        examples = training_data.training_examples
+        for example in examples:
+            self.normalize_message(example)
+        elapsed = perf_counter() - start
+        if examples:
+            log.info(
+                f"normalized {len(examples)} examples in {elapsed * 1000:.1f}ms "
+                f"({elapsed * 1e6 / len(examples):.1f}us/message)"
+            )
+
     def process(self, message: Message, **kwargs: Any) -> None:
         txt = message.get(TEXT)
         if txt is None:
             return
+        start = perf_counter()
         try:
-            # remove all chars not in list; condense multiple spaces to one
-            # out = re.sub(r"[^A-Za-z0-9 \#\@\$\£\+\-\_]", " ", txt)
-            out = re.sub(r"[,;.]", " ", txt)
-            out = re.sub("\s\s+", " ", out)
-            message.set(TEXT, out)
-        except:
-            print(f"error found with text\n{txt}")
+            message.set(TEXT, self.normalize(txt))
+        except Exception:
+            log.exception(f"error found with text\n{txt}")
+        elapsed = perf_counter() - start
+
+        self.count += 1
+        self.elapsed += elapsed
+        log.debug(f"normalized text in {elapsed * 1e6:.1f}us")
+        if self.count % self.component_config["report_every"] == 0:
+            log.info(
+                f"normalized {self.count} messages "
+                f"({self.elapsed * 1e6 / self.count:.1f}us/message)"
+            )
 
     @classmethod
     def load(
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+benchmark the custom actions in-process with synthetic trackers
+
+    openweather, positionstack and spotify are replaced by local stand-in servers
+    in a separate process with configurable latency and failure rate. the actions
+    are pointed at them using the endpoint environment variables.
+
+    for each scenario
+        first call (module import, clients, data loading) reported separately
+        p50/p95/p99 latency of the remaining calls
+        peak and retained memory allocated per call using tracemalloc
+        errors i.e. exceptions raised by the action
+
+    --save writes the results as json. --baseline compares with a saved run and
+    exits with 1 if any scenario is slower or allocates more than --tolerance.
+
+run from the project root so the actions package can be imported
+"""
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from docopt import docopt
+
+sys.path.insert(0, os.getcwd())
+
+log = logging.getLogger()
+
+SERVICES = ["geocode", "weather", "spotify"]
+
+# (track, artist, album) returned by the spotify stand-in
+CATALOG = [
+    ("Eraser", "Ed Sheeran", "Divide"),
+    ("Shape of You", "Ed Sheeran", "Divide"),
+    ("Perfect", "Ed Sheeran", "Divide"),
+    ("Heroes", "David Bowie", "Heroes"),
+    ("Changes", "David Bowie", "Hunky Dory"),
+    ("Money", "Pink Floyd", "The Dark Side of the Moon"),
+    ("Time", "Pink Floyd", "The Dark Side of the Moon"),
+    ("Come Together", "The Beatles", "Abbey Road"),
+    ("Something", "The Beatles", "Abbey Road"),
+] + [(f"Track {i}", f"Artist {i % 7}", f"Album {i % 5}") for i in range(40)]
+
+# connaught place to gurgaon with a point every 500m or so
+ROUTE = [
+    (28.6315 + (28.4595 - 28.6315) * i / 60, 77.2167 + (77.0266 - 77.2167) * i / 60)
+    for i in range(61)
+]
+
+################################################################
+# stand-in servers
+
+
+def spotify_search(query):
+    """ catalog entries matching all the field:value terms in the query """
+    fields = dict(track=0, artist=1, album=2)
+    terms = {}
+    # words without a field continue the previous field e.g. artist:ed sheeran
+    current = 0
+    for part in query.lower().split(" "):
+        field, _, value = part.partition(":")
+        if value and field in fields:
+            current = fields[field]
+            part = value
+        if part:
+            terms[current] = f"{terms.get(current, '')} {part}".strip()
+    return [
+        x for x in CATALOG if all(v in x[i].lower() for i, v in terms.items())
+    ]
+
+
+def spotify_track(track, artist, album):
+    return dict(
+        name=track,
+        artists=[dict(name=artist)],
+        album=dict(name=album),
+        uri=f"spotify:track:{abs(hash(track))}",
+    )
+
+
+def respond(service, path, params):
+    """ return json for a request to a stand-in """
+    if service == "geocode":
+        return dict(
+            data=[dict(latitude=51.507, longitude=-0.128, label=params.get("query"))]
+        )
+    if service == "weather":
+        return dict(
+            current=dict(temp=14.2),
+            daily=[dict(temp=dict(day=10.0 + i)) for i in range(8)],
+        )
+    if path.endswith("/api/token"):
+        return dict(access_token="standin", token_type="Bearer", expires_in=3600)
+    if path.endswith("/search"):
+        items = spotify_search(params.get("q", ""))
+        limit = int(params.get("limit", 10))
+        offset = int(params.get("offset", 0))
+        page = items[offset : offset + limit]
+        return dict(
+            tracks=dict(
+                items=[spotify_track(*x) for x in page],
+                limit=limit,
+                offset=offset,
+                total=len(items),
+                next=None if offset + limit >= len(items) else "next",
+            )
+        )
+    return None
+
+
+def serve(service, latency, failure, queue):
+    """ run a stand-in server. sends the port on the queue when ready. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.reply()
+
+        def do_POST(self):
+            self.reply()
+
+        def reply(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                body = self.rfile.read(length).decode()
+                params.update({k: v[0] for k, v in parse_qs(body).items()})
+            sleep(random.uniform(0.5, 1.5) * latency / 1000)
+            status = 503 if random.random() < failure else 200
+            data = respond(service, url.path, params) if status == 200 else None
+            if status == 200 and data is None:
+                status = 404
+            content = json.dumps(data or dict(error=status)).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_standins(latency, failure):
+    """ start stand-in servers and point the actions at them """
+    processes = []
+    ports = {}
+    for service in SERVICES:
+        queue = Queue()
+        p = Process(
+            target=serve,
+            args=(service, latency[service], failure[service], queue),
+            daemon=True,
+        )
+        p.start()
+        ports[service] = queue.get(timeout=10)
+        processes.append(p)
+
+    os.environ.update(
+        POSITION_STACK_API_ENDPOINT=f"http://127.0.0.1:{ports['geocode']}/v1/forward",
+        POSITION_STACK_API_KEY="standin",
+        OPEN_WEATHER_MAP_API_ENDPOINT=f"http://127.0.0.1:{ports['weather']}/data/2.5/onecall",
+        OPEN_WEATHER_MAP_API_KEY="standin",
+        SPOTIFY_API_PREFIX=f"http://127.0.0.1:{ports['spotify']}/v1/",
+        SPOTIFY_TOKEN_URL=f"http://127.0.0.1:{ports['spotify']}/api/token",
+    )
+    creds = os.path.join(tempfile.mkdtemp(), "creds.yml")
+    with open(creds, "w") as f:
+        f.write("client_id: standin\nclient_secret: standin\nredirect_uri: http://localhost\n")
+    os.environ["SPOTIFY_CREDS"] = creds
+    return processes
+
+
+################################################################
+# scenarios
+
+
+def tracker(slots=None, text="", entities=None, intent=None, metadata=None):
+    from rasa_sdk import Tracker
+
+    latest_message = dict(
+        text=text,
+        entities=entities or [],
+        intent=dict(name=intent, confidence=1.0),
+        metadata=metadata or {},
+    )
+    return Tracker(
+        "benchmark", slots or {}, latest_message, [], False, None, {}, "action_listen"
+    )
+
+
+def time_entity(text, days):
+    value = (date.today() + timedelta(days=days)).isoformat()
+    return dict(
+        entity="time",
+        value=f"{value}T00:00:00.000+00:00",
+        text=text,
+        extractor="EnzoEntityExtractor",
+    )
+
+
+def weather_tracker(text, days, **slots):
+    entity = time_entity(text, days)
+    slots = dict(location="London", unit="metric", time=entity["value"], **slots)
+    return tracker(slots, f"weather in london {text}", [entity], "weather")
+
+
+def action_run(path, tracker):
+    """ return function that runs an action. imported on first call. """
+    action = None
+
+    def run(dispatcher):
+        nonlocal action
+        if action is None:
+            from importlib import import_module
+
+            module, cls = path.rsplit(".", 1)
+            action = getattr(import_module(module), cls)()
+        return action.run(dispatcher, tracker, {})
+
+    return run
+
+
+def form_validate(path, slot, value, tracker):
+    """ return function that calls validate_<slot> of a form validation action """
+    form = None
+
+    def run(dispatcher):
+        nonlocal form
+        if form is None:
+            from importlib import import_module
+
+            module, cls = path.rsplit(".", 1)
+            form = getattr(import_module(module), cls)()
+        return getattr(form, f"validate_{slot}")(value, dispatcher, tracker, {})
+
+    return run
+
+
+def contact(value):
+    def run(dispatcher):
+        from actions.CallAndMessage.contactValidation import validate_contact_name
+
+        return validate_contact_name(value, dispatcher)
+
+    return run
+
+
+def scenarios():
+    ordinal = dict(
+        entity="ordinal", value=2, text="second", additional_info=dict(value=2)
+    )
+    choices = ["Pizza Hut", "Domino's Pizza", "Pizza Express"]
+    return {
+        "weather_today": action_run(
+            "actions.weather.Weather", weather_tracker("today", 0)
+        ),
+        "weather_tomorrow": action_run(
+            "actions.weather.Weather", weather_tracker("tomorrow", 1)
+        ),
+        "weather_temperature": action_run(
+            "actions.weather.WeatherTemperature",
+            weather_tracker("tomorrow", 1, hotcold="cold"),
+        ),
+        "music_song_artist": action_run(
+            "actions.music.SubmitMusicPlayForm",
+            tracker(dict(song="eraser", artist="ed sheeran"), "play eraser by ed sheeran"),
+        ),
+        "music_album": action_run(
+            "actions.music.SubmitMusicPlayForm",
+            tracker(dict(album="abbey road"), "play the album abbey road"),
+        ),
+        "navigate_search": form_validate(
+            "actions.navigate_forms.ValidateNavigateSearchForm",
+            "search",
+            "pizza",
+            tracker(dict(search="pizza"), "find me a pizza"),
+        ),
+        "navigate_search_nearby": form_validate(
+            "actions.navigate_forms.ValidateNavigateSearchForm",
+            "search",
+            "cheap pizza",
+            tracker(
+                dict(search="cheap pizza"),
+                "find me a cheap pizza",
+                metadata=dict(location=dict(lat=28.6315, lon=77.2167)),
+            ),
+        ),
+        "navigate_search_route": form_validate(
+            "actions.navigate_forms.ValidateNavigateSearchForm",
+            "search",
+            "coffee",
+            tracker(
+                dict(search="coffee", active_route=["Gurgaon"]),
+                "find coffee on the way",
+                metadata=dict(route=ROUTE),
+            ),
+        ),
+        "navigate_choice": form_validate(
+            "actions.navigate_forms.ValidateNavigateSearchForm",
+            "choice",
+            "second",
+            tracker(dict(choices=choices), "the second one", [ordinal]),
+        ),
+        "contact_exact": contact("anna"),
+        "contact_partial": contact("watson"),
+        "analyse_speed": action_run(
+            "actions.navigate.ActionAnalyseSpeed", tracker(text="how was my driving")
+        ),
+    }
+
+
+################################################################
+# measurement
+
+
+def call(loop, run):
+    """ call once. async actions are run to completion. """
+    from rasa_sdk.executor import CollectingDispatcher
+
+    result = run(CollectingDispatcher())
+    if inspect.isawaitable(result):
+        result = loop.run_until_complete(result)
+    return result
+
+
+def measure(loop, run, iterations, alloc_iterations):
+    errors = 0
+
+    def timed():
+        nonlocal errors
+        start = perf_counter()
+        try:
+            call(loop, run)
+        except Exception:
+            errors += 1
+            log.debug("action failed", exc_info=True)
+        return (perf_counter() - start) * 1000
+
+    first = timed()
+    latency = np.array([timed() for _ in range(iterations)])
+
+    # separate pass as tracing slows the calls
+    peak = []
+    retained = []
+    tracemalloc.start()
+    for _ in range(alloc_iterations):
+        # also resets the peak
+        tracemalloc.clear_traces()
+        try:
+            call(loop, run)
+        except Exception:
+            pass
+        current, top = tracemalloc.get_traced_memory()
+        peak.append(top)
+        retained.append(current)
+    tracemalloc.stop()
+
+    return dict(
+        first_ms=round(first, 3),
+        p50_ms=round(np.percentile(latency, 50), 3),
+        p95_ms=round(np.percentile(latency, 95), 3),
+        p99_ms=round(np.percentile(latency, 99), 3),
+        peak_kb=round(np.median(peak) / 1024, 1) if peak else 0.0,
+        retained_kb=round(np.median(retained) / 1024, 1) if retained else 0.0,
+        errors=errors,
+        calls=iterations + 1,
+    )
+
+
+def compare(results, baseline, tolerance):
+    """ log changes from baseline and return names of regressed scenarios """
+    regressed = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        changes = []
+        for key in ["p50_ms", "p95_ms", "p99_ms", "peak_kb"]:
+            if not b.get(key) or r.get(key) is None:
+                continue
+            ratio = r[key] / b[key]
+            changes.append(f"{key}={ratio - 1:+.0%}")
+            if ratio > 1 + tolerance:
+                regressed.append(name)
+        flag = "REGRESSION" if name in regressed else ""
+        log.info(f"{name:22} {' '.join(changes)} {flag}")
+    return sorted(set(regressed))
+
+
+def per_service(value, cast):
+    """ "50" for all services or "geocode=20,weather=80,spotify=100" """
+    if "=" not in value:
+        return {s: cast(value) for s in SERVICES}
+    out = {s: cast(0) for s in SERVICES}
+    for item in value.split(","):
+        service, v = item.split("=")
+        out[service.strip()] = cast(v)
+    return out
+
+
+def main():
+    """
+    Usage:
+        benchmark_actions.py [options]
+
+    Options:
+        -h --help                   Show this screen.
+        --only=<names>              comma separated scenarios. default all.
+        --iterations=<n>            timed calls per scenario [default: 50]
+        --alloc-iterations=<n>      calls traced for allocations [default: 10]
+        --latency=<ms>              stand-in latency. one value or service=ms,... [default: 50]
+        --failure=<rate>            stand-in failure rate. one value or service=rate,... [default: 0]
+        --save=<path>               save results as json
+        --baseline=<path>           compare with saved results
+        --tolerance=<x>             allowed increase over baseline [default: 0.2]
+        --seed=<n>                  random seed [default: 42]
+    """
+    params = docopt(main.__doc__)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # actions log every call
+    logging.getLogger("actions").setLevel(logging.WARNING)
+
+    latency = per_service(params["--latency"], float)
+    failure = per_service(params["--failure"], float)
+    processes = start_standins(latency, failure)
+    random.seed(int(params["--seed"]))
+
+    selected = scenarios()
+    if params["--only"]:
+        names = params["--only"].split(",")
+        unknown = set(names) - set(selected)
+        if unknown:
+            sys.exit(f"unknown scenarios {unknown}. choose from {list(selected)}")
+        selected = {k: v for k, v in selected.items() if k in names}
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    log.info(
+        f"{'scenario':22} {'first':>9} {'p50':>9} {'p95':>9} {'p99':>9} "
+        f"{'peak':>9} {'retained':>9} {'errors':>6}"
+    )
+    for name, run in selected.items():
+        r = measure(
+            loop, run, int(params["--iterations"]), int(params["--alloc-iterations"])
+        )
+        results[name] = r
+        log.info(
+            f"{name:22} {r['first_ms']:7.1f}ms {r['p50_ms']:7.1f}ms "
+            f"{r['p95_ms']:7.1f}ms {r['p99_ms']:7.1f}ms "
+            f"{r['peak_kb']:7.1f}kb {r['retained_kb']:7.1f}kb {r['errors']:6}"
+        )
+    loop.close()
+    for p in processes:
+        p.terminate()
+
+    if params["--save"]:
+        with open(params["--save"], "w") as f:
+            json.dump(
+                dict(latency=latency, failure=failure, results=results), f, indent=2
+            )
+        log.info(f"saved results to {params['--save']}")
+
+    if params["--baseline"]:
+        with open(params["--baseline"]) as f:
+            baseline = json.load(f)
+        if baseline["latency"] != latency or baseline["failure"] != failure:
+            log.warning("baseline used different stand-in latency or failure rate")
+        regressed = compare(results, baseline["results"], float(params["--tolerance"]))
+        if regressed:
+            log.warning(f"regressions in {regressed}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+compare the float and int8 quantized transformer featurizer on the nlu data
+
+    latency per message for each mode
+    cosine similarity of quantized to float sentence features
+    intent accuracy of a nearest centroid classifier on the sentence features
+        quick proxy for the accuracy change. for DIET itself copy config.yml with
+        quantize: true and compare with rasa test nlu --config config.yml <copy>
+
+run from the project root so enzo components can be imported
+"""
+import logging
+import os
+import random
+import sys
+from time import perf_counter
+
+import numpy as np
+import yaml
+from docopt import docopt
+
+sys.path.insert(0, os.getcwd())
+
+from rasa.shared.nlu.training_data.loading import load_data
+from rasa.shared.nlu.training_data.training_data import TrainingData
+from rasa.shared.nlu.constants import TEXT, INTENT
+from rasa.nlu.constants import SENTENCE_FEATURES
+from rasa.nlu.tokenizers.whitespace_tokenizer import WhitespaceTokenizer
+
+from enzopreprocessor import EnzoPreprocessor
+from enzofeaturizer import LanguageModelFeaturizer
+
+log = logging.getLogger()
+
+
+def featurize(featurizer, messages):
+    """ return sentence features and latency in ms for each message """
+    features = []
+    latency = []
+    for message in messages:
+        start = perf_counter()
+        doc = featurizer._get_docs_for_batch([message], TEXT, inference_mode=True)[0]
+        latency.append((perf_counter() - start) * 1000)
+        features.append(doc[SENTENCE_FEATURES].reshape(-1))
+    return np.array(features), np.array(latency)
+
+
+def centroid_accuracy(train_x, train_y, test_x, test_y):
+    intents = sorted(set(train_y))
+    normed = train_x / np.linalg.norm(train_x, axis=1, keepdims=True)
+    centroids = np.array(
+        [normed[[y == intent for y in train_y]].mean(axis=0) for intent in intents]
+    )
+    test = test_x / np.linalg.norm(test_x, axis=1, keepdims=True)
+    predicted = [intents[i] for i in (test @ centroids.T).argmax(axis=1)]
+    return np.mean([p == y for p, y in zip(predicted, test_y)])
+
+
+def main():
+    """
+    Usage:
+        benchmark_featurizer.py [--data=<path>] [--config=<path>] [--sample=<n>]
+
+    Options:
+        -h --help           Show this screen.
+        --data=<path>       nlu training data [default: data]
+        --config=<path>     config with the LanguageModelFeaturizer [default: config.yml]
+        --sample=<n>        max examples used [default: 2000]
+    """
+    params = docopt(main.__doc__)
+    logging.basicConfig(level=logging.INFO)
+
+    with open(params["--config"]) as f:
+        pipeline = yaml.safe_load(f)["pipeline"]
+    lm_config = [c for c in pipeline if c["name"].endswith("LanguageModelFeaturizer")][0]
+    lm_config = {k: v for k, v in lm_config.items() if k != "name"}
+    lm_config["feature_cache_dir"] = None
+
+    examples = [
+        x for x in load_data(params["--data"]).intent_examples if x.get(TEXT)
+    ]
+    random.seed(42)
+    random.shuffle(examples)
+    examples = examples[: int(params["--sample"])]
+    data = TrainingData(examples)
+    EnzoPreprocessor().train(data)
+    WhitespaceTokenizer().train(data)
+
+    split = int(len(examples) * 0.8)
+    train, test = examples[:split], examples[split:]
+    train_y = [x.get(INTENT) for x in train]
+    test_y = [x.get(INTENT) for x in test]
+
+    results = {}
+    for quantize in [False, True]:
+        featurizer = LanguageModelFeaturizer({**lm_config, "quantize": quantize})
+        # excludes the one off tflite conversion from latency
+        featurize(featurizer, train[:1])
+        train_x, _ = featurize(featurizer, train)
+        test_x, latency = featurize(featurizer, test)
+        accuracy = centroid_accuracy(train_x, train_y, test_x, test_y)
+        results[quantize] = dict(features=test_x, latency=latency, accuracy=accuracy)
+
+    for quantize, r in results.items():
+        name = "quantized" if quantize else "float"
+        log.info(
+            f"{name:10} p50={np.percentile(r['latency'], 50):.1f}ms "
+            f"p95={np.percentile(r['latency'], 95):.1f}ms accuracy={r['accuracy']:.3f}"
+        )
+
+    base, quant = results[False], results[True]
+    cosine = np.sum(base["features"] * quant["features"], axis=1) / (
+        np.linalg.norm(base["features"], axis=1)
+        * np.linalg.norm(quant["features"], axis=1)
+    )
+    speedup = np.median(base["latency"]) / np.median(quant["latency"])
+    log.info(
+        f"latency p50 {speedup:.2f}x faster, "
+        f"accuracy delta {quant['accuracy'] - base['accuracy']:+.3f}, "
+        f"cosine similarity mean={cosine.mean():.4f} min={cosine.min():.4f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+parse a jsonl file of logged utterances with a trained model e.g. to check for drift
+
+    each worker process loads the nlu model once
+    lines are streamed to the workers in micro-batches. at most 4 batches per worker
+    are in flight so memory does not grow with the size of the file.
+    output is one json line per input line, in the same order, with the input fields
+    plus "parse" (the nlu result) and "parse_ms"
+
+run from the project root so enzo components can be imported
+"""
+import json
+import logging
+import os
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from time import perf_counter
+
+from docopt import docopt
+
+sys.path.insert(0, os.getcwd())
+
+log = logging.getLogger()
+
+# set in each worker by init
+interpreter = None
+field = None
+
+
+def init(nlu_path, text_field, threads):
+    """ load the model once per worker """
+    global interpreter, field
+    import tensorflow as tf
+    from rasa.nlu.model import Interpreter
+
+    # each worker gets its own cores rather than all workers sharing all cores
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+    interpreter = Interpreter.load(nlu_path)
+    field = text_field
+
+
+def to_json(x):
+    # numpy scalars from the classifiers
+    return x.item() if hasattr(x, "item") else str(x)
+
+
+def parse_batch(lines):
+    """ return output lines for a batch of input lines """
+    out = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+            start = perf_counter()
+            record["parse"] = interpreter.parse(record[field])
+            record["parse_ms"] = round((perf_counter() - start) * 1000, 3)
+        except Exception as e:
+            record = dict(error=repr(e), line=line.rstrip("\n"))
+        out.append(json.dumps(record, default=to_json))
+    return out
+
+
+def batches(f, size):
+    """ non blank lines in lists of up to size. ends when the file does. """
+    while True:
+        lines = list(islice(f, size))
+        if not lines:
+            return
+        batch = [line for line in lines if line.strip()]
+        if batch:
+            yield batch
+
+
+def main():
+    """
+    Usage:
+        bulkparse.py <model> <input> <output> [options]
+
+    model=trained model archive e.g. models/20211130-120000.tar.gz
+    input=jsonl file with one utterance per line
+    output=jsonl file of results
+
+    Options:
+        -h --help           Show this screen.
+        --field=<name>      field with the utterance text [default: text]
+        --workers=<n>       worker processes [default: 4]
+        --batch=<n>         lines per micro-batch [default: 64]
+        --threads=<n>       tensorflow threads per worker [default: 1]
+    """
+    params = docopt(main.__doc__)
+    logging.basicConfig(level=logging.INFO)
+    from rasa.model import get_model, get_model_subdirectories
+
+    workers = int(params["--workers"])
+    size = int(params["--batch"])
+    max_pending = workers * 4
+
+    start = perf_counter()
+    count = 0
+    with get_model(params["<model>"]) as unpacked:
+        _, nlu_path = get_model_subdirectories(unpacked)
+        initargs = (nlu_path, params["--field"], int(params["--threads"]))
+        with Pool(workers, initializer=init, initargs=initargs) as pool, open(
+            params["<input>"]
+        ) as fin, open(params["<output>"], "w") as fout:
+
+            def write(result):
+                nonlocal count
+                lines = result.get()
+                fout.write("\n".join(lines) + "\n")
+                count += len(lines)
+                if count % (size * max_pending) < len(lines):
+                    rate = count / (perf_counter() - start)
+                    log.info(f"parsed {count} lines ({rate:.0f}/s)")
+
+            pending = deque()
+            for batch in batches(fin, size):
+                pending.append(pool.apply_async(parse_batch, (batch,)))
+                if len(pending) >= max_pending:
+                    write(pending.popleft())
+            while pending:
+                write(pending.popleft())
+
+    elapsed = perf_counter() - start
+    log.info(f"parsed {count} lines in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+prune near duplicate nlu training examples
+
+    examples are compared after replacing entity values with their entity and role
+    so "navigate to [paris](location)" and "navigate to [rome](location)" match.
+    near duplicates within each intent are clustered using minhash of word shingles
+    with locality sensitive hashing.
+
+    the pruned data keeps
+        every (entity, role) with at least --min-entity examples where the original had
+        one example from each cluster, largest clusters first, up to --size
+
+    output is a copy of the data folder with the nlu files pruned so it can be
+    used directly e.g. rasa train --data pruned
+"""
+import logging
+import os
+import re
+import shutil
+import hashlib
+from collections import Counter, defaultdict
+from itertools import zip_longest
+
+import numpy as np
+from docopt import docopt
+
+from rasa.shared.nlu.training_data.loading import load_data
+from rasa.shared.nlu.training_data.training_data import TrainingData
+from rasa.shared.nlu.training_data.formats.rasa_yaml import RasaYAMLWriter
+from rasa.shared.nlu.constants import (
+    TEXT,
+    ENTITIES,
+    ENTITY_ATTRIBUTE_TYPE,
+    ENTITY_ATTRIBUTE_ROLE,
+)
+
+log = logging.getLogger()
+
+PRIME = (1 << 31) - 1
+
+
+def template(message):
+    """ text with entity values replaced by <entity:role> """
+    text = message.get(TEXT)
+    out = []
+    pos = 0
+    for e in sorted(message.get(ENTITIES) or [], key=lambda e: e["start"]):
+        out.append(text[pos : e["start"]])
+        out.append(f" <{e[ENTITY_ATTRIBUTE_TYPE]}:{e.get(ENTITY_ATTRIBUTE_ROLE)}> ")
+        pos = e["end"]
+    out.append(text[pos:])
+    return re.findall(r"<[^>]+>|\w+", "".join(out).lower())
+
+
+def shingles(tokens, n=2):
+    if len(tokens) < n:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)}
+
+
+class MinHash:
+    def __init__(self, num_perm=64, seed=42):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, num_perm).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, num_perm).astype(np.uint64)
+
+    def signature(self, items):
+        x = np.array(
+            [
+                int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little")
+                % PRIME
+                for s in items
+            ],
+            dtype=np.uint64,
+        )
+        return ((np.outer(x, self.a) + self.b) % PRIME).min(axis=0)
+
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def cluster(signatures, threshold, bands):
+    """ return cluster id for each signature using lsh banding """
+    n = len(signatures)
+    parent = list(range(n))
+    if n < 2:
+        return parent
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        buckets = defaultdict(list)
+        part = signatures[:, band * rows : (band + 1) * rows]
+        for i in range(n):
+            buckets[part[i].tobytes()].append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                a, b = find(parent, first), find(parent, other)
+                if a == b:
+                    continue
+                similarity = np.mean(signatures[first] == signatures[other])
+                if similarity >= threshold:
+                    parent[b] = a
+    return [find(parent, i) for i in range(n)]
+
+
+def entity_keys(message):
+    return {
+        (e[ENTITY_ATTRIBUTE_TYPE], e.get(ENTITY_ATTRIBUTE_ROLE))
+        for e in message.get(ENTITIES) or []
+    }
+
+
+def prune(examples, size, threshold, bands, min_entity):
+    """ return set of indexes to keep and the clusters for each intent """
+    minhash = MinHash()
+    by_intent = defaultdict(list)
+    for i, message in enumerate(examples):
+        by_intent[message.get_full_intent()].append(i)
+
+    # clusters as lists of example indexes, largest first
+    clusters = {}
+    for intent, indexes in by_intent.items():
+        signatures = np.array(
+            [minhash.signature(shingles(template(examples[i]))) for i in indexes]
+        )
+        groups = defaultdict(list)
+        for i, c in zip(indexes, cluster(signatures, threshold, bands)):
+            groups[c].append(i)
+        clusters[intent] = sorted(groups.values(), key=len, reverse=True)
+
+    keep = set()
+
+    # entity coverage. rarest (entity, role) first so they are not crowded out.
+    covered = Counter()
+    coverage = Counter(k for m in examples for k in entity_keys(m))
+    for key, _ in sorted(coverage.items(), key=lambda x: x[1]):
+        candidates = [i for i, m in enumerate(examples) if key in entity_keys(m)]
+        # prefer examples that also cover other entities
+        candidates.sort(key=lambda i: len(entity_keys(examples[i])), reverse=True)
+        for i in candidates:
+            if covered[key] >= min(min_entity, coverage[key]):
+                break
+            if i not in keep:
+                keep.add(i)
+                covered.update(entity_keys(examples[i]))
+
+    # one per cluster then second members etc. round robin over intents
+    rounds = defaultdict(list)
+    for intent, groups in clusters.items():
+        depth = 0
+        while True:
+            members = [g[depth] for g in groups if len(g) > depth]
+            if not members:
+                break
+            rounds[depth].append(members)
+            depth += 1
+    order = [
+        i
+        for depth in sorted(rounds)
+        for members in zip_longest(*rounds[depth])
+        for i in members
+        if i is not None
+    ]
+    if size is None:
+        # one per cluster
+        keep.update(i for members in rounds[0] for i in members)
+        return keep, clusters
+    for i in order:
+        if len(keep) >= size:
+            break
+        keep.add(i)
+    return keep, clusters
+
+
+def main():
+    """
+    Usage:
+        prune.py <data> <output> [options]
+
+    data=folder with the training data
+    output=folder for the pruned copy
+
+    Options:
+        -h --help               Show this screen.
+        --size=<n>              target number of examples. default one per cluster.
+        --threshold=<x>         minhash similarity for near duplicates [default: 0.8]
+        --bands=<n>             lsh bands of the 64 minhashes [default: 16]
+        --min-entity=<n>        examples kept for each entity and role [default: 3]
+    """
+    params = docopt(main.__doc__)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    data, output = params["<data>"], params["<output>"]
+    shutil.copytree(data, output, dirs_exist_ok=True)
+
+    # examples with the file they came from so the folder structure is kept
+    files = {}
+    examples = []
+    sources = []
+    for name in sorted(os.listdir(data)):
+        path = os.path.join(data, name)
+        if not name.endswith((".yml", ".yaml", ".md", ".json")):
+            continue
+        td = load_data(path)
+        if not td.intent_examples:
+            continue
+        files[name] = td
+        examples.extend(td.intent_examples)
+        sources.extend([name] * len(td.intent_examples))
+
+    size = int(params["--size"]) if params["--size"] else None
+    keep, clusters = prune(
+        examples,
+        size,
+        float(params["--threshold"]),
+        int(params["--bands"]),
+        int(params["--min-entity"]),
+    )
+
+    log.info(f"{'intent':50} {'examples':>8} {'clusters':>8} {'redundant':>9} {'kept':>6}")
+    for intent, groups in sorted(clusters.items()):
+        total = sum(len(g) for g in groups)
+        kept = sum(1 for g in groups for i in g if i in keep)
+        log.info(
+            f"{intent:50} {total:8} {len(groups):8} "
+            f"{1 - len(groups) / total:9.0%} {kept:6}"
+        )
+
+    before = Counter(k for m in examples for k in entity_keys(m))
+    after = Counter(k for i in keep for k in entity_keys(examples[i]))
+    missing = set(before) - set(after)
+    if missing:
+        log.warning(f"entity coverage lost for {missing}")
+    log.info(
+        f"kept {len(keep)} of {len(examples)} examples ({len(keep) / len(examples):.0%}). "
+        f"entity/role pairs covered {len(after)} of {len(before)}"
+    )
+
+    writer = RasaYAMLWriter()
+    for name, td in files.items():
+        kept = [m for i, (m, s) in enumerate(zip(examples, sources)) if s == name and i in keep]
+        pruned = TrainingData(
+            kept,
+            entity_synonyms=td.entity_synonyms,
+            regex_features=td.regex_features,
+            lookup_tables=td.lookup_tables,
+            responses=td.responses,
+        )
+        target = os.path.join(output, os.path.splitext(name)[0] + ".yml")
+        if target != os.path.join(output, name):
+            os.remove(os.path.join(output, name))
+        writer.dump(target, pruned)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("rasa")
+
+from enzoextractor import extract_distances, extract_durations
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["I am hungry", "call me at 7 am", "go afoot", "a minimal route", "an hourly bus"],
+)
+def test_no_distance_or_duration_in_words(text):
+    assert extract_distances(text) == []
+    assert extract_durations(text) == []
+
+
+@pytest.mark.parametrize(
+    "text, value, unit",
+    [
+        ("5km", 5, "kilometre"),
+        ("5 km", 5, "kilometre"),
+        ("a mile", 1, "mile"),
+        ("twenty one metres", 21, "metre"),
+    ],
+)
+def test_distance(text, value, unit):
+    [match] = extract_distances(text)
+    assert match["value"]["value"] == value
+    assert match["value"]["unit"] == unit
+
+
+@pytest.mark.parametrize(
+    "text, seconds",
+    [("10 minutes", 600), ("an hour", 3600), ("2hours", 7200)],
+)
+def test_duration(text, seconds):
+    [match] = extract_durations(text)
+    assert match["value"]["normalized"]["value"] == seconds